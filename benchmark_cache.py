@@ -0,0 +1,126 @@
+"""
+Size, write time and read time of the cache entries of 'run_simulation'
+(one record per subject in the shard files), for each codec of 'use_pickle'
+"""
+
+import time
+import shutil
+import tempfile
+import numpy as np
+
+import utils.cache.compression as compression
+import utils.cache.shards as shards
+import utils.sampling as sampling
+import utils.rng as rng
+
+N_SUBJECTS = 1000
+N_SHARDS = 16
+N_REPEAT = 5
+
+# Task and population of 'draft.py'
+N = 2
+P = np.array([0.5, 0.75])
+T = 500
+RW_HET_POP_DIST_PARAM = (0.15, 0.05), (10.0, 0.5)
+RW_FIT_BOUNDS = (0.0, 1.0), (1.0, 20.0)
+
+
+def simulate_rw_pop(seed=0):
+
+    """
+    Choices and successes of a population of RW agents, simulated
+    as by 'run_sim_lockstep' in 'draft.py' (which can't be imported
+    without running the whole script). The rules of the loop are
+    copies of 'RW.batch_decision_rule' and 'RW.batch_updating_rule',
+    to be kept in sync with them
+    :return: list of (seed, param), arrays (N_SUBJECTS, T) x 2
+    """
+
+    gen = rng.generator(seed)
+    param = np.array([[gen.normal(*p) for p in RW_HET_POP_DIST_PARAM]
+                      for _ in range(N_SUBJECTS)])
+    # With this many subjects, a few draws fall out of the bounds
+    bounds = np.array(RW_FIT_BOUNDS)
+    param = np.clip(param, bounds[:, 0], bounds[:, 1])
+    seeds = rng.spawn_seeds(seed, N_SUBJECTS)
+
+    u = np.array([rng.generator(s).random((T, 2)) for s in seeds])
+    idx = np.arange(N_SUBJECTS)
+    q_values = np.full((N_SUBJECTS, N), 0.5)
+
+    choices = np.zeros((N_SUBJECTS, T), dtype=int)
+    successes = np.zeros((N_SUBJECTS, T), dtype=bool)
+
+    for t in range(T):
+
+        v = np.exp(param[:, 1, None] * q_values)
+        choice = sampling.categorical(v / np.sum(v, axis=1)[:, None],
+                                      u[:, t, 0])
+        success = sampling.bernoulli(P[choice], u[:, t, 1])
+
+        q_chosen = q_values[idx, choice]
+        q_values[idx, choice] += param[:, 0] * (success - q_chosen)
+
+        choices[:, t] = choice
+        successes[:, t] = success
+
+    return list(zip(seeds, param)), choices, successes
+
+
+def main():
+
+    calls, choices, successes = simulate_rw_pop()
+    keys = [f"{i:040x}" for i in range(N_SUBJECTS)]
+    raw_bytes = choices[0].nbytes + successes[0].nbytes
+
+    print(f"run_simulation output: {N_SUBJECTS} subjects x {T} trials "
+          f"({raw_bytes / 1024:.1f} kB per subject in memory), "
+          f"{N_SHARDS} shards\n")
+    print(f"{'codec':<8}{'record (B)':>12}{'ratio':>8}"
+          f"{'encode (ms)':>13}{'write (ms)':>12}{'read (ms)':>11}")
+
+    for codec in (None, ) + tuple(compression.CODECS):
+
+        encode_time, write_time, read_time = [], [], []
+
+        for _ in range(N_REPEAT):
+
+            folder = tempfile.mkdtemp()
+            try:
+                t0 = time.perf_counter()
+                records = {}
+                for key, (seed, param), c, s in \
+                        zip(keys, calls, choices, successes):
+                    info = {'args': (), 'kwargs': dict(seed=seed,
+                                                       param=param)}
+                    records[key], _ = shards.encode_record(
+                        key, (c, s), info, codec=codec)
+                t1 = time.perf_counter()
+                # As when leaving 'prefetch': one write per shard
+                shards.append_shards(folder, records, N_SHARDS)
+                t2 = time.perf_counter()
+                # As a new process would: indexes not known yet
+                shards._shard_indexes.clear()
+                entries = shards.read_shards(folder, keys, N_SHARDS)
+                t3 = time.perf_counter()
+            finally:
+                shutil.rmtree(folder)
+
+            assert all(np.array_equal(entries[key][0][0], c)
+                       and np.array_equal(entries[key][0][1], s)
+                       for key, c, s in zip(keys, choices, successes))
+
+            encode_time.append(t1 - t0)
+            write_time.append(t2 - t1)
+            read_time.append(t3 - t2)
+
+        size = np.mean([len(r) for r in records.values()])
+
+        print(f"{str(codec):<8}{size:>12.0f}{raw_bytes / size:>8.1f}"
+              f"{np.median(encode_time) * 1e3:>13.1f}"
+              f"{np.median(write_time) * 1e3:>12.1f}"
+              f"{np.median(read_time) * 1e3:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
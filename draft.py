@@ -6,13 +6,19 @@ Modeling of decision-making
 # Import your modules =============================================
 # =================================================================
 
+import functools
 import numpy as np
 import scipy.optimize
 import scipy.stats
+import scipy.stats.qmc
 from itertools import product
-from tqdm.autonotebook import tqdm
 
 from utils.decorator import use_pickle
+import utils.sampling as sampling
+import utils.rng as rng
+import utils.jit as jit
+import utils.executor as parallel
+import utils.checkpoint as checkpoint
 import stats.stats as stats
 import plot.plot as plot
 
@@ -37,6 +43,19 @@ N_SUBJECTS = 30
 # Design the models  ===================================================
 # ======================================================================
 
+class BatchState:
+    """
+    Stacked state of a batch of agents sharing the same model
+    (one row per agent)
+    """
+
+    def __init__(self, param, n_param):
+        self.n_agents = len(param)
+        self.param = np.reshape(np.asarray(param, dtype=float),
+                                (self.n_agents, n_param))
+        self.idx = np.arange(self.n_agents)
+
+
 class Random:
     """
     Random selection
@@ -48,9 +67,8 @@ class Random:
     def __init__(self):
         self.options = np.arange(N)
 
-    def choose(self):
-        p = self.decision_rule()
-        return np.random.choice(self.options, p=p)
+    def choose(self, sampler):
+        return sampler.categorical(self.decision_rule())
 
     def learn(self, option, success):
         self.updating_rule(option=option, success=success)
@@ -61,6 +79,18 @@ class Random:
     def updating_rule(self, option, success):
         pass
 
+    @classmethod
+    def batch_state(cls, param):
+        return BatchState(param=param, n_param=len(cls.param_labels))
+
+    @classmethod
+    def batch_decision_rule(cls, state):
+        return np.ones((state.n_agents, N)) / N
+
+    @classmethod
+    def batch_updating_rule(cls, state, options, successes):
+        pass
+
 
 class WSLS(Random):
     """
@@ -105,6 +135,34 @@ class WSLS(Random):
         self.r = success
         self.c = option
 
+    @classmethod
+    def batch_state(cls, param):
+        state = super().batch_state(param)
+        state.c = np.full(state.n_agents, -1)
+        state.r = np.zeros(state.n_agents, dtype=bool)
+        return state
+
+    @classmethod
+    def batch_decision_rule(cls, state):
+
+        epsilon = state.param[:, 0]
+
+        # Probability of each option that is not the previous choice
+        p_other = np.where(state.r, epsilon / N,
+                           (1 - epsilon) / (N - 1) + epsilon / N)
+
+        same = np.arange(N) == state.c[:, None]
+        p = np.where(same, (1 - p_other * (N - 1))[:, None],
+                     p_other[:, None])
+
+        p[state.c == -1] = 1 / N  # First turn
+        return p
+
+    @classmethod
+    def batch_updating_rule(cls, state, options, successes):
+        state.r = np.asarray(successes, dtype=bool)
+        state.c = np.asarray(options)
+
 
 class RW(Random):
     """
@@ -129,6 +187,66 @@ class RW(Random):
         self.q_values[option] += \
             self.q_alpha * (success - self.q_values[option])
 
+    @classmethod
+    def batch_state(cls, param, initial_value=0.5):
+        state = super().batch_state(param)
+        state.q_values = np.full((state.n_agents, N), initial_value)
+        return state
+
+    @classmethod
+    def batch_decision_rule(cls, state):
+        q_beta = state.param[:, 1, None]
+        v = np.exp(q_beta * state.q_values)
+        return v / np.sum(v, axis=1)[:, None]
+
+    @classmethod
+    def batch_updating_rule(cls, state, options, successes):
+        q_alpha = state.param[:, 0]
+        q_chosen = state.q_values[state.idx, options]
+        state.q_values[state.idx, options] += \
+            q_alpha * (successes - q_chosen)
+
+    @classmethod
+    def batch_grad_state(cls, param):
+
+        """
+        'batch_state', with the derivatives of the latent variables
+        w.r.t. the parameters (see 'log_likelihood_grad_batch')
+        """
+
+        state = cls.batch_state(param)
+        state.dq_values = np.zeros((state.n_agents, N))  # d / d q_alpha
+        return state
+
+    @classmethod
+    def batch_logits_grad(cls, state):
+
+        """
+        Derivatives of the logits of 'batch_decision_rule'
+        w.r.t. each parameter
+        :return: array (n_agents, n_param, N)
+        """
+
+        q_beta = state.param[:, 1, None]
+        return np.stack((q_beta * state.dq_values, state.q_values), axis=1)
+
+    @classmethod
+    def batch_updating_rule_grad(cls, state, options, successes):
+
+        """
+        'batch_updating_rule' of the model, after the update of the
+        derivatives (which uses the old values)
+        """
+
+        q_alpha = state.param[:, 0]
+        q_chosen = state.q_values[state.idx, options]
+        state.dq_values[state.idx, options] = \
+            (1 - q_alpha) * state.dq_values[state.idx, options] \
+            + (successes - q_chosen)
+
+        cls.batch_updating_rule(state=state, options=options,
+                                successes=successes)
+
 
 class RWCK(RW):
 
@@ -168,6 +286,63 @@ class RWCK(RW):
 
         super().updating_rule(option=option, success=success)
 
+    @classmethod
+    def batch_state(cls, param, initial_value=0.5):
+        state = super().batch_state(param, initial_value=initial_value)
+        state.c_values = np.zeros((state.n_agents, N))
+        return state
+
+    @classmethod
+    def batch_decision_rule(cls, state):
+        q_beta, c_beta = state.param[:, 1, None], state.param[:, 3, None]
+        v = np.exp(
+            (q_beta * state.q_values) +
+            (c_beta * state.c_values)
+        )
+        return v / np.sum(v, axis=1)[:, None]
+
+    @classmethod
+    def batch_updating_rule(cls, state, options, successes):
+
+        c_alpha = state.param[:, 2, None]
+
+        a = np.zeros((state.n_agents, N), dtype=int)
+        a[state.idx, options] = 1
+
+        state.c_values[:] += \
+            c_alpha * (a - state.c_values[:])
+
+        super().batch_updating_rule(state=state, options=options,
+                                    successes=successes)
+
+    @classmethod
+    def batch_grad_state(cls, param):
+        state = super().batch_grad_state(param)
+        state.dc_values = np.zeros((state.n_agents, N))  # d / d c_alpha
+        return state
+
+    @classmethod
+    def batch_logits_grad(cls, state):
+        c_beta = state.param[:, 3, None]
+        return np.concatenate((
+            super().batch_logits_grad(state),
+            np.stack((c_beta * state.dc_values, state.c_values), axis=1)),
+            axis=1)
+
+    @classmethod
+    def batch_updating_rule_grad(cls, state, options, successes):
+
+        c_alpha = state.param[:, 2, None]
+
+        a = np.zeros((state.n_agents, N), dtype=int)
+        a[state.idx, options] = 1
+
+        state.dc_values[:] = \
+            (1 - c_alpha) * state.dc_values + (a - state.c_values)
+
+        super().batch_updating_rule_grad(state=state, options=options,
+                                         successes=successes)
+
 
 # =================================================================
 # Define your model space =========================================
@@ -176,6 +351,269 @@ class RWCK(RW):
 MODELS = Random, WSLS, RW, RWCK
 MODEL_NAMES = [m.__name__ for m in MODELS]
 
+# =================================================================
+# Compiled trial loops (used if Numba is available) ===============
+# =================================================================
+
+# Identifier of each model in the compiled kernels
+JIT_MODEL_ID = {Random: 0, WSLS: 1, RW: 2, RWCK: 3}
+
+
+@jit.jit
+def kernel_decision_rule(model_id, param, q_values, c_values, c, r, p):
+
+    """
+    Write the probabilities of choice in 'p'
+    (no allocation, as it is called at every time step)
+    """
+
+    n_option = len(p)
+
+    if model_id == 0 or (model_id == 1 and c == -1):
+        for k in range(n_option):
+            p[k] = 1 / n_option
+
+    elif model_id == 1:
+        epsilon = param[0]
+        if r:
+            p_other = epsilon / n_option
+        else:
+            p_other = (1 - epsilon) / (n_option - 1) + epsilon / n_option
+        for k in range(n_option):
+            p[k] = p_other
+        p[c] = 1 - p_other * (n_option - 1)
+
+    else:
+        total = 0.0
+        for k in range(n_option):
+            v = param[1] * q_values[k]
+            if model_id == 3:
+                v += param[3] * c_values[k]
+            p[k] = np.exp(v)
+            total += p[k]
+        for k in range(n_option):
+            p[k] /= total
+
+
+@jit.jit
+def kernel_updating_rule(model_id, param, q_values, c_values,
+                         option, success):
+
+    if model_id == 3:
+        for k in range(len(c_values)):
+            a = 1.0 if k == option else 0.0
+            c_values[k] += param[2] * (a - c_values[k])
+
+    if model_id >= 2:
+        s = 1.0 if success else 0.0
+        q_values[option] += param[0] * (s - q_values[option])
+
+
+@jit.jit
+def kernel_simulation(model_id, param, u, p_success, n_option):
+
+    """
+    :param u: uniform numbers (n_iteration, 2), drawn in the same order
+    as 'run_simulation' (choice, then success)
+    """
+
+    n_iteration = len(u)
+
+    q_values = np.full(n_option, 0.5)
+    c_values = np.zeros(n_option)
+    c, r = -1, False
+
+    p = np.zeros(n_option)
+
+    choices = np.zeros(n_iteration, dtype=np.int64)
+    successes = np.zeros(n_iteration, dtype=np.bool_)
+
+    for t in range(n_iteration):
+
+        kernel_decision_rule(model_id, param, q_values, c_values, c, r, p)
+
+        # Inverse of the cumulative distribution
+        choice = n_option - 1
+        total = np.sum(p)
+        cumulative = 0.0
+        for i in range(n_option):
+            cumulative += p[i]
+            if cumulative / total > u[t, 0]:
+                choice = i
+                break
+
+        success = u[t, 1] >= 1 - p_success[choice]
+
+        kernel_updating_rule(model_id, param, q_values, c_values,
+                             choice, success)
+        c, r = choice, success
+
+        choices[t] = choice
+        successes[t] = success
+
+    return choices, successes
+
+
+@jit.jit
+def kernel_log_likelihood(model_id, param, choices, successes,
+                          n_option, eps):
+
+    q_values = np.full(n_option, 0.5)
+    c_values = np.zeros(n_option)
+    c, r = -1, False
+
+    p = np.zeros(n_option)
+    ll = np.zeros(len(choices))
+
+    for t in range(len(choices)):
+
+        kernel_decision_rule(model_id, param, q_values, c_values, c, r, p)
+        ll[t] = np.log(p[choices[t]] + eps)
+
+        kernel_updating_rule(model_id, param, q_values, c_values,
+                             choices[t], successes[t])
+        c, r = choices[t], successes[t]
+
+    return np.sum(ll)
+
+
+@jit.jit
+def kernel_latent_variables(model_id, param, choices, successes, n_option):
+
+    n_iteration = len(choices)
+
+    q_values = np.full(n_option, 0.5)
+    c_values = np.zeros(n_option)
+    c, r = -1, False
+
+    q_values_hist = np.zeros((n_iteration, n_option))
+    p_choices = np.zeros((n_iteration, n_option))
+
+    for t in range(n_iteration):
+
+        q_values_hist[t] = q_values
+        kernel_decision_rule(model_id, param, q_values, c_values, c, r,
+                             p_choices[t])
+
+        kernel_updating_rule(model_id, param, q_values, c_values,
+                             choices[t], successes[t])
+        c, r = choices[t], successes[t]
+
+    return q_values_hist, p_choices
+
+
+@jit.jit
+def kernel_logits_grad(model_id, param, q_values, c_values,
+                       dq_values, dc_values, dv):
+
+    """
+    Write in 'dv' (n_param, n_option) the derivatives of the logits
+    of 'kernel_decision_rule' w.r.t. each parameter,
+    for RW (model_id=2) or RWCK (model_id=3)
+    """
+
+    for k in range(len(q_values)):
+        dv[0, k] = param[1] * dq_values[k]
+        dv[1, k] = q_values[k]
+        if model_id == 3:
+            dv[2, k] = param[3] * dc_values[k]
+            dv[3, k] = c_values[k]
+
+
+@jit.jit
+def kernel_updating_rule_grad(model_id, param, q_values, c_values,
+                              dq_values, dc_values, option, success):
+
+    """
+    'kernel_updating_rule', after the update of the derivatives of the
+    q-values (w.r.t. alpha_q) and of the choice kernel (w.r.t. alpha_c),
+    which uses the old values
+    """
+
+    if model_id == 3:
+        for k in range(len(c_values)):
+            a = 1.0 if k == option else 0.0
+            dc_values[k] = (1 - param[2]) * dc_values[k] + (a - c_values[k])
+
+    s = 1.0 if success else 0.0
+    dq_values[option] = \
+        (1 - param[0]) * dq_values[option] + (s - q_values[option])
+
+    kernel_updating_rule(model_id, param, q_values, c_values,
+                         option, success)
+
+
+@jit.jit
+def kernel_log_likelihood_grad(model_id, param, choices, successes,
+                               n_option, eps):
+
+    """
+    Log-likelihood of RW (model_id=2) or RWCK (model_id=3), and its
+    gradient, obtained by propagating the derivatives of the q-values
+    (w.r.t. alpha_q) and of the choice kernel (w.r.t. alpha_c)
+    along the updates
+    """
+
+    n_param = len(param)
+
+    q_values = np.full(n_option, 0.5)
+    c_values = np.zeros(n_option)
+    dq_values = np.zeros(n_option)
+    dc_values = np.zeros(n_option)
+    c, r = -1, False
+
+    p = np.zeros(n_option)
+    dv = np.zeros((n_param, n_option))
+    ll = np.zeros(len(choices))
+    grad = np.zeros(n_param)
+
+    for t in range(len(choices)):
+
+        kernel_decision_rule(model_id, param, q_values, c_values, c, r, p)
+        ll[t] = np.log(p[choices[t]] + eps)
+
+        # d log(p_c + eps) = p_c / (p_c + eps) * d log p_c
+        kernel_logits_grad(model_id, param, q_values, c_values,
+                           dq_values, dc_values, dv)
+        w = p[choices[t]] / (p[choices[t]] + eps)
+        for j in range(n_param):
+            mean = 0.0
+            for k in range(n_option):
+                mean += p[k] * dv[j, k]
+            grad[j] += w * (dv[j, choices[t]] - mean)
+
+        kernel_updating_rule_grad(model_id, param, q_values, c_values,
+                                  dq_values, dc_values,
+                                  choices[t], successes[t])
+        c, r = choices[t], successes[t]
+
+    return np.sum(ll), grad
+
+
+@jit.jit
+def kernel_log_likelihood_grad_batch(model_id, param, choices, successes,
+                                     n_option, eps):
+
+    """
+    'kernel_log_likelihood_grad' for each row of 'param',
+    'choices' and 'successes' (one subject per row)
+    """
+
+    n_sets = param.shape[0]
+    ll = np.zeros(n_sets)
+    grad = np.zeros(param.shape)
+    for i in range(n_sets):
+        ll_i, grad_i = kernel_log_likelihood_grad(
+            model_id, param[i], choices[i], successes[i], n_option, eps)
+        ll[i] = ll_i
+        grad[i, :] = grad_i
+    return ll, grad
+
+
+def use_kernel(model):
+    return jit.enabled() and model in JIT_MODEL_ID
+
+
 # =================================================================
 # Study the effect of your parameters =============================
 # =================================================================
@@ -241,11 +679,17 @@ plot.rw_beta(param_values=PARAM_VALUES,
 # Single agent simulation =========================================
 # =================================================================
 
-@use_pickle
+@use_pickle(max_bytes=256 * 1024 ** 2, compress='zlib', shards=16)
 def run_simulation(seed, agent_model, param=()):
 
-    # Seed the pseudo-random number generator
-    np.random.seed(seed)
+    if use_kernel(agent_model):
+        u = rng.generator(seed).random((T, 2))
+        return kernel_simulation(
+            JIT_MODEL_ID[agent_model], np.asarray(param, dtype=float),
+            u, P, N)
+
+    # Independent pseudo-random number generator for this agent
+    sampler = sampling.Sampler(rng.generator(seed))
 
     # Create the agent
     agent = agent_model(*param)
@@ -258,13 +702,10 @@ def run_simulation(seed, agent_model, param=()):
     for t in range(T):
 
         # Determine choice
-        choice = agent.choose()
+        choice = agent.choose(sampler)
 
         # Determine success
-        p_success = P[choice]
-        success = np.random.choice(
-            [0, 1],
-            p=np.array([1 - p_success, p_success]))
+        success = sampler.bernoulli(P[choice])
 
         # Make agent learn
         agent.learn(option=choice, success=success)
@@ -305,6 +746,11 @@ def latent_variables_rw(choices, successes, param):
     Specific to RW
     """
 
+    if use_kernel(RW):
+        return kernel_latent_variables(
+            JIT_MODEL_ID[RW], np.asarray(param, dtype=float),
+            np.asarray(choices), np.asarray(successes), N)
+
     # Create the agent
     agent = RW(*param)
 
@@ -345,31 +791,138 @@ plot.latent_variables_rw_and_behavior_single(q_values=Q_VALUES_SINGLE,
 # Population simulation
 # ========================================================================
 
-@use_pickle
-def run_sim_pop(model, param, n_subjects):
+def run_sim_lockstep(model, param, seeds):
+
+    """
+    Simulate all the subjects in lockstep, trial after trial.
+    Subject i uses the same random numbers (and therefore gets the same
+    data) as a call to 'run_simulation' with seed=seeds[i]
+    """
+
+    n_subjects = len(seeds)
 
-    print(f"Running simulation for {n_subjects} agents...")
+    # Random numbers of each subject, drawn from its own stream
+    # (one for the choice, one for the success at each time step)
+    u = np.array([rng.generator(s).random((T, 2)) for s in seeds])
+
+    # Create the agents
+    state = model.batch_state([param[i] for i in range(n_subjects)])
 
     # Data containers
     choices = np.zeros((n_subjects, T), dtype=int)
     successes = np.zeros((n_subjects, T), dtype=bool)
 
-    for i in tqdm(range(n_subjects)):
+    # Simulate the task
+    for t in range(T):
+
+        # Determine choices
+        p_choice = model.batch_decision_rule(state)
+        choice = sampling.categorical(p_choice, u[:, t, 0])
+
+        # Determine successes
+        success = sampling.bernoulli(P[choice], u[:, t, 1])
 
-        # Get choices and successes
-        c, s = run_simulation(seed=i,
-                              agent_model=model,
-                              param=param[i])
+        # Make agents learn
+        model.batch_updating_rule(state=state, options=choice,
+                                  successes=success)
 
         # Backup
-        choices[i] = c
-        successes[i] = s
+        choices[:, t] = choice
+        successes[:, t] = success
 
     return choices, successes
 
 
-@use_pickle
-def latent_variables_rw_pop(choices, successes, param):
+def run_sim_chunk(idx, model, param, seeds, choices, successes):
+
+    """
+    Simulate the subjects 'idx' (consecutive), and write their data
+    in place (arrays are handles, see 'utils.shared')
+    """
+
+    rows = slice(idx[0], idx[-1] + 1)
+    choices.array[rows], successes.array[rows] = run_sim_lockstep(
+        model=model, param=param.array[rows], seeds=seeds.array[rows])
+    return idx
+
+
+def run_sim_pop(model, param, n_subjects, executor=None):
+
+    """
+    Subject i is the call to 'run_simulation' with seed=i: subjects
+    already in its cache are reused (so that growing a population
+    only simulates the new ones), the others are simulated by chunks
+    (see 'run_sim_lockstep') and added to this cache
+    """
+
+    calls = [dict(seed=i, agent_model=model, param=param[i])
+             for i in range(n_subjects)]
+
+    subjects = run_simulation.lookup(calls)
+
+    missing = [i for i in range(n_subjects) if i not in subjects]
+    if missing:
+        print(f"Running simulation for {len(missing)} agents...")
+
+        # Data containers
+        choices = np.zeros((len(missing), T), dtype=int)
+        successes = np.zeros((len(missing), T), dtype=bool)
+
+        executor = parallel.get(executor)
+        with executor.shared(
+                np.array([param[i] for i in missing], dtype=float),
+                np.array(missing), choices, successes) as buffers:
+            executor.map_batches(
+                functools.partial(run_sim_chunk, model=model,
+                                  param=buffers[0], seeds=buffers[1],
+                                  choices=buffers[2], successes=buffers[3]),
+                range(len(missing)))
+
+        subjects.update(zip(missing, run_simulation.store(
+            calls=[calls[i] for i in missing],
+            outputs=list(zip(choices, successes)))))
+
+    choices = np.zeros((n_subjects, T), dtype=int)
+    successes = np.zeros((n_subjects, T), dtype=bool)
+    for i in range(n_subjects):
+        choices[i], successes[i] = subjects[i]
+    return choices, successes
+
+
+def latent_variables_rw_chunk(idx, choices, successes, param,
+                              q_values, p_choices):
+
+    """
+    Specific to RW. Compute the latent variables of the subjects 'idx'
+    (consecutive), and write them in place (see 'run_sim_chunk')
+    """
+
+    rows = slice(idx[0], idx[-1] + 1)
+    choices, successes = choices.array[rows], successes.array[rows]
+    q_values, p_choices = q_values.array[rows], p_choices.array[rows]
+
+    # Create the agents
+    state = RW.batch_state(param.array[rows])
+
+    # (Re-)Simulate the task for all the subjects of the chunk at once
+    for t in range(T):
+
+        # Register values
+        q_values[:, t] = state.q_values
+
+        # Register probabilities of choices
+        p_choices[:, t] = RW.batch_decision_rule(state)
+
+        # Make agents learn
+        RW.batch_updating_rule(state=state,
+                               options=choices[:, t],
+                               successes=successes[:, t])
+
+    return idx
+
+
+@use_pickle(ignore=('executor', ))
+def latent_variables_rw_pop(choices, successes, param, executor=None):
 
     """
     Specific to RW
@@ -381,16 +934,16 @@ def latent_variables_rw_pop(choices, successes, param):
     q_values = np.zeros((n_subjects, T, N))
     p_choices = np.zeros((n_subjects, T, N))
 
-    for i in range(n_subjects):
-
-        # Get q-values and choice probabilities
-        qv, pc = latent_variables_rw(choices=choices[i],
-                                     successes=successes[i],
-                                     param=param[i])
-
-        # Backup
-        q_values[i] = qv
-        p_choices[i] = pc
+    executor = parallel.get(executor)
+    with executor.shared(choices, successes,
+                         np.asarray(param, dtype=float),
+                         q_values, p_choices) as buffers:
+        executor.map_batches(
+            functools.partial(latent_variables_rw_chunk,
+                              choices=buffers[0], successes=buffers[1],
+                              param=buffers[2], q_values=buffers[3],
+                              p_choices=buffers[4]),
+            range(n_subjects))
 
     return q_values, p_choices
 
@@ -419,6 +972,11 @@ plot.latent_variables_rw_and_behavior_pop(
 
 def log_likelihood(model, param, choices, successes):
 
+    if use_kernel(model):
+        return kernel_log_likelihood(
+            JIT_MODEL_ID[model], np.asarray(param, dtype=float),
+            np.asarray(choices), np.asarray(successes), N, EPS)
+
     # Create the agent
     agent = model(*param)
 
@@ -444,6 +1002,184 @@ def log_likelihood(model, param, choices, successes):
     return np.sum(ll)
 
 
+def log_likelihood_batch(model, param, choices, successes):
+
+    """
+    Log-likelihood of a batch of parameter sets, computed
+    in a single pass over the trials.
+    :param param: array-like (n_sets, n_param)
+    :param choices: array-like (T, ) shared by all the sets,
+    or (n_sets, T) for one trace per set
+    :param successes: same shape as 'choices'
+    :return: array (n_sets, )
+    """
+
+    # Create the agents
+    state = model.batch_state(param)
+
+    choices = np.broadcast_to(choices, (state.n_agents, T))
+    successes = np.broadcast_to(successes, (state.n_agents, T))
+
+    # Data container
+    ll = np.zeros((state.n_agents, T))
+
+    # Simulate the task
+    for t in range(T):
+
+        # Get choices and successes for t
+        c, s = choices[:, t], successes[:, t]
+
+        # Look at probability of choice
+        p_choice = model.batch_decision_rule(state)
+        p = p_choice[state.idx, c]
+
+        # Compute log
+        ll[:, t] = np.log(p + EPS)
+
+        # Make agents learn
+        model.batch_updating_rule(state=state, options=c, successes=s)
+
+    return np.sum(ll, axis=1)
+
+
+# Models for which the gradient of the log-likelihood is known
+GRADIENT_MODELS = RW, RWCK
+
+
+def log_likelihood_grad_batch(model, param, choices, successes):
+
+    """
+    Log-likelihood of a batch of parameter sets for RW or RWCK,
+    and its gradient w.r.t. the parameters, computed with the rules
+    of the model (see 'log_likelihood_batch'), the derivatives of the
+    latent variables being propagated along the updates
+    (see 'RW.batch_updating_rule_grad')
+    :param param: array-like (n_sets, n_param)
+    :param choices: array-like (T, ) or (n_sets, T)
+    :param successes: same shape as 'choices'
+    :return: array (n_sets, ), array (n_sets, n_param)
+    """
+
+    assert model in GRADIENT_MODELS, \
+        f"No gradient available for {model.__name__}"
+
+    # Create the agents
+    state = model.batch_grad_state(param)
+
+    choices = np.broadcast_to(choices, (state.n_agents, T))
+    successes = np.broadcast_to(successes, (state.n_agents, T))
+
+    # Data containers
+    ll = np.zeros((state.n_agents, T))
+    grad = np.zeros(state.param.shape)
+
+    for t in range(T):
+
+        # Get choices and successes for t
+        c, s = choices[:, t], successes[:, t]
+
+        # Look at probability of choice
+        p_choice = model.batch_decision_rule(state)
+        p = p_choice[state.idx, c]
+
+        # Compute log
+        ll[:, t] = np.log(p + EPS)
+
+        # Derivative of the logits w.r.t. each parameter (n_sets, n_param, N)
+        dv = model.batch_logits_grad(state)
+
+        # d log(p + EPS) = p / (p + EPS) * d log p
+        d_log_p = dv[state.idx, :, c] - np.sum(p_choice[:, None] * dv, axis=2)
+        grad += (p / (p + EPS))[:, None] * d_log_p
+
+        # Make agents learn (and update the derivatives)
+        model.batch_updating_rule_grad(state=state, options=c, successes=s)
+
+    return np.sum(ll, axis=1), grad
+
+
+def log_likelihood_and_grad(model, param, choices, successes):
+
+    if use_kernel(model):
+        return kernel_log_likelihood_grad(
+            JIT_MODEL_ID[model], np.asarray(param, dtype=float),
+            np.asarray(choices), np.asarray(successes), N, EPS)
+
+    ll, grad = log_likelihood_grad_batch(model=model, param=[param],
+                                         choices=choices,
+                                         successes=successes)
+    return ll[0], grad[0]
+
+
+def compress_random(choices, successes):
+
+    """
+    The likelihood of Random only depends on the number of trials
+    """
+
+    shape = np.shape(choices)
+    return np.full(shape[:-1] + (1, ), shape[-1])
+
+
+def log_likelihood_random(param, stats):
+    n_trials = stats[..., 0]
+    return n_trials * np.log(1 / N + EPS)
+
+
+def compress_wsls(choices, successes):
+
+    """
+    The likelihood of WSLS only depends on the number of first trials
+    and on the counts of stay/switch after a win/loss
+    """
+
+    choices = np.asarray(choices)
+    win = np.asarray(successes, dtype=bool)[..., :-1]
+    stay = choices[..., 1:] == choices[..., :-1]
+
+    return np.stack((
+        np.full(choices.shape[:-1], min(choices.shape[-1], 1)),
+        np.sum(win & stay, axis=-1),
+        np.sum(win & ~stay, axis=-1),
+        np.sum(~win & stay, axis=-1),
+        np.sum(~win & ~stay, axis=-1)), axis=-1)
+
+
+def log_likelihood_wsls(param, stats):
+
+    epsilon = np.asarray(param, dtype=float)[..., 0]
+    n_first, win_stay, win_switch, lose_stay, lose_switch = \
+        np.moveaxis(stats, -1, 0)
+
+    # Probability of each option that is not the previous choice
+    p_other_win = epsilon / N
+    p_other_lose = (1 - epsilon) / (N - 1) + epsilon / N
+
+    return n_first * np.log(1 / N + EPS) \
+        + win_stay * np.log(1 - p_other_win * (N - 1) + EPS) \
+        + win_switch * np.log(p_other_win + EPS) \
+        + lose_stay * np.log(1 - p_other_lose * (N - 1) + EPS) \
+        + lose_switch * np.log(p_other_lose + EPS)
+
+
+# Models whose likelihood can be computed from a few counts
+# (compression of the data, log-likelihood given the counts)
+SUFFICIENT_STATISTICS = {
+    Random: (compress_random, log_likelihood_random),
+    WSLS: (compress_wsls, log_likelihood_wsls)
+}
+
+
+# Number of new starts of a fit that fails
+N_RETRIES = 5
+
+# Multi-start: number of starting points, number of starts that have
+# to reach the same optimum (up to 'AGREE_TOL') to stop early
+N_STARTS = 1
+N_AGREE = 3
+AGREE_TOL = 1e-4
+
+
 class BanditOptimizer:
 
     """
@@ -460,32 +1196,444 @@ class BanditOptimizer:
         assert hasattr(model, 'fit_bounds'), \
             f"{model.__name__} has not 'fit_bounds' attribute"
 
+        # Use the exact gradient if known (otherwise, finite differences)
+        self.jac = model in GRADIENT_MODELS
+
+        # If possible, reduce the data once to the counts
+        # that the likelihood depends on
+        if model in SUFFICIENT_STATISTICS:
+            compress, self.ll_from_stats = SUFFICIENT_STATISTICS[model]
+            self.stats = compress(choices, successes)
+        else:
+            self.ll_from_stats, self.stats = None, None
+
         self.t = 0
 
     def objective(self, param):
+
+        if self.stats is not None:
+            return - self.ll_from_stats(param, self.stats)
+
+        if self.jac:
+            ll, grad = log_likelihood_and_grad(model=self.model,
+                                               choices=self.choices,
+                                               successes=self.successes,
+                                               param=param)
+            return - ll, - grad
+
         return - log_likelihood(model=self.model,
                                 choices=self.choices,
                                 successes=self.successes,
                                 param=param)
 
-    def run(self):
+    def starting_points(self, n_starts):
 
-        if self.model.fit_bounds:
-            res = scipy.optimize.minimize(
+        """
+        The centre of the bounds, then points of a (scrambled, always
+        the same) Sobol sequence over the bounds, sorted by increasing
+        value of the objective (computed for all of them at once)
+        :return: array (n_starts, n_param)
+        """
+
+        bounds = np.array(self.model.fit_bounds)
+        centre = bounds.mean(axis=1)
+        if n_starts == 1:
+            return centre[None, :]
+
+        sobol = scipy.stats.qmc.Sobol(d=len(bounds), seed=0)
+        points = sobol.random_base2(m=int(np.ceil(np.log2(n_starts - 1))))
+        points = np.vstack((
+            centre, scipy.stats.qmc.scale(points[:n_starts - 1],
+                                          bounds[:, 0], bounds[:, 1])))
+
+        ll = log_likelihood_batch(model=self.model, param=points,
+                                  choices=self.choices,
+                                  successes=self.successes)
+        return points[np.argsort(-ll, kind='stable')]
+
+    def minimize_from(self, x0):
+
+        """
+        :return: result of 'scipy.optimize.minimize',
+        or None in case of error
+        """
+
+        try:
+            return scipy.optimize.minimize(
                 fun=self.objective,
-                x0=np.array([(b[1] - b[0])/2 for b in self.model.fit_bounds]),
-                bounds=self.model.fit_bounds)
-            assert res.success, f"{self.model.__name__}: {res.message}"
+                x0=x0,
+                bounds=self.model.fit_bounds,
+                jac=self.jac)
+        except (ValueError, ArithmeticError):
+            return None
+
+    def run(self, n_starts=N_STARTS, n_retries=N_RETRIES, n_agree=N_AGREE,
+            executor=None):
+
+        """
+        Minimize the objective from several starting points, by waves
+        :param n_starts: int, number of starting points
+        :param n_retries: int, number of new starts if none converges
+        :param n_agree: int, number of starts that have to agree to stop
+        :param executor: Executor, name of a backend or None (serial),
+        to run the starts of each wave
+        :return: (best-fit parameters, best value of the objective);
+        also sets 'self.status' ('converged', 'retried' or 'failed'),
+        'self.n_runs' and 'self.spread'
+        """
+
+        self.n_runs = 0
+        self.spread = np.zeros(len(self.model.fit_bounds))
+
+        if not self.model.fit_bounds:
+            assert self.model == Random
+            self.status = 'converged'
+            return (), self.objective(())
+
+        bounds = np.array(self.model.fit_bounds)
+
+        # No progress bar for the starts of a single fit
+        if executor is None or isinstance(executor, str):
+            executor = parallel.Executor(backend=executor or "serial",
+                                         progress=False)
+
+        # A single pool for all the waves
+        with executor.kept_open():
+
+            converged, failed = self.run_starts(
+                self.starting_points(n_starts), n_agree=n_agree,
+                executor=executor)
+            self.status = 'converged'
+
+            if not converged:
+                # Initial points of the new starts
+                retries = rng.generator(0).uniform(
+                    bounds[:, 0], bounds[:, 1],
+                    size=(n_retries, len(bounds)))
+
+                converged, failed_again = self.run_starts(
+                    retries, n_agree=1, executor=executor)
+                failed += failed_again
+                self.status = 'retried'
+
+        if converged:
+            self.spread = np.std([res.x for res in converged], axis=0)
+            best = min(converged, key=lambda res: res.fun)
+            return best.x, best.fun
+
+        self.status = 'failed'
+        if not failed:
+            return np.full(len(bounds), np.nan), np.inf
+        best = min(failed, key=lambda res: res.fun)
+        return best.x, best.fun
+
+    def run_starts(self, starts, n_agree, executor):
+
+        """
+        Minimize from each starting point, by waves, until 'n_agree'
+        starts converge to the same optimum (up to 'AGREE_TOL')
+        :return: (list of results that converged,
+        list of results that didn't)
+        """
+
+        converged, failed = [], []
+
+        for i in range(0, len(starts), executor.n_workers):
+
+            wave = starts[i:i + executor.n_workers]
+            for res in executor.map(self.minimize_from, wave):
+                self.n_runs += 1
+                if res is None:
+                    continue
+                if res.success:
+                    converged.append(res)
+                elif np.isfinite(res.fun):
+                    failed.append(res)
+
+            if converged:
+                best = min(res.fun for res in converged)
+                if sum(res.fun - best <= AGREE_TOL
+                       for res in converged) >= n_agree:
+                    break
+
+        return converged, failed
+
+
+@use_pickle(compress='zlib', shards=16)
+def fit_model(model, choices, successes, n_starts=N_STARTS,
+              n_retries=N_RETRIES):
+
+    """
+    Fit of a model to the data of one subject, cached for each
+    (model, data) pair: comparisons are assembled from these fits,
+    so that adding a model or a subject only fits the new pairs.
+    A fit that fails doesn't raise: it is flagged
+    :return: (best-fit parameters, best value of the objective,
+    status, spread of the solutions of the starts
+    (see 'BanditOptimizer.run'))
+    """
+
+    # Create the optimizer and run it
+    opt = BanditOptimizer(choices=choices,
+                          successes=successes,
+                          model=model)
+    best_param, best_value = opt.run(n_starts=n_starts,
+                                     n_retries=n_retries)
+    return best_param, best_value, opt.status, opt.spread
+
+
+def report_failures(status, outcome="the best points found are used"):
+
+    """
+    Print how many fits failed (if any)
+    :param status: array-like of status (see 'BanditOptimizer.run')
+    :param outcome: string, what is done with them
+    """
+
+    n_failed = np.sum(np.asarray(status) == 'failed')
+    if n_failed:
+        print(f"Warning: {n_failed} fit(s) failed to converge "
+              f"({outcome})")
+
+
+# Joint fit: tolerances on the projected gradient and on the decrease
+# of the objective of each subject, maximum number of iterations
+# (beyond it, the fit fails)
+JOINT_GTOL = 1e-5
+JOINT_FTOL = 1e-9
+JOINT_MAX_ITER = 500
+
+
+class PopulationOptimizer:
+
+    """
+    Given the choices and successes of several subjects, and a DM model,
+    estimate the best-fit param of every subject in a single run.
+    The fits are separable (each subject only depends on its own
+    parameters): each subject has its own quasi-Newton (BFGS) steps
+    within the bounds, but all the subjects that are not done yet
+    move in lockstep, so that each iteration evaluates their
+    likelihoods and gradients at once.
+    The parameters are rescaled to [0, 1] within the bounds
+    """
 
-            best_param = res.x
-            best_value = res.fun
+    def __init__(self, choices, successes, model):
+
+        """
+        :param choices: array-like (n_subjects, T)
+        :param successes: same shape as 'choices'
+        """
+
+        self.choices = np.ascontiguousarray(choices)
+        self.successes = np.ascontiguousarray(successes)
+        self.model = model
+
+        assert hasattr(model, 'fit_bounds'), \
+            f"{model.__name__} has not 'fit_bounds' attribute"
 
+        self.n_subjects = len(self.choices)
+        self.bounds = np.array(model.fit_bounds, dtype=float).reshape(-1, 2)
+        self.n_param = len(self.bounds)
+
+        # As in 'BanditOptimizer'
+        self.jac = model in GRADIENT_MODELS
+
+        if model in SUFFICIENT_STATISTICS:
+            compress, self.ll_from_stats = SUFFICIENT_STATISTICS[model]
+            self.stats = compress(self.choices, self.successes)
         else:
+            self.ll_from_stats, self.stats = None, None
+
+    def to_param(self, u):
+        lo, hi = self.bounds[:, 0], self.bounds[:, 1]
+        return lo + u * (hi - lo)
+
+    def log_likelihood(self, param, rows):
+
+        """
+        :param param: array (n_rows, n_param)
+        :param rows: array of int, index of the subjects
+        :return: array (n_rows, )
+        """
+
+        if self.stats is not None:
+            return self.ll_from_stats(param, self.stats[rows])
+
+        return log_likelihood_batch(model=self.model, param=param,
+                                    choices=self.choices[rows],
+                                    successes=self.successes[rows])
+
+    def log_likelihood_and_grad(self, param, rows):
+
+        """
+        :param param: array (n_rows, n_param)
+        :param rows: array of int, index of the subjects
+        :return: array (n_rows, ), array (n_rows, n_param)
+        """
+
+        if not len(rows):  # No subject (left)
+            return np.zeros(0), np.zeros((0, self.n_param))
+
+        if self.jac and use_kernel(self.model):
+            return kernel_log_likelihood_grad_batch(
+                JIT_MODEL_ID[self.model], param, self.choices[rows],
+                self.successes[rows], N, EPS)
+
+        if self.jac:
+            return log_likelihood_grad_batch(
+                model=self.model, param=param,
+                choices=self.choices[rows], successes=self.successes[rows])
+
+        # Central differences, one parameter of all the subjects at once
+        # (the subjects are independent), within the bounds
+        ll = self.log_likelihood(param, rows)
+        grad = np.zeros(param.shape)
+        for k in range(self.n_param):
+            step = 1e-6 * np.maximum(1, np.abs(param[:, k]))
+            up, down = param.copy(), param.copy()
+            up[:, k] = np.minimum(param[:, k] + step, self.bounds[k, 1])
+            down[:, k] = np.maximum(param[:, k] - step, self.bounds[k, 0])
+            grad[:, k] = (self.log_likelihood(up, rows)
+                          - self.log_likelihood(down, rows)) \
+                / (up[:, k] - down[:, k])
+        return ll, grad
+
+    def objective(self, u, rows):
+
+        """
+        :param u: array (n_rows, n_param), rescaled parameters
+        :return: values of the objective (n_rows, ) and their gradients
+        w.r.t. 'u' (n_rows, n_param)
+        """
+
+        ll, grad = self.log_likelihood_and_grad(self.to_param(u), rows)
+        return - ll, - grad * (self.bounds[:, 1] - self.bounds[:, 0])
+
+    def run(self):
+
+        """
+        Minimize the objective of each subject from the centre of the
+        bounds. The outcome of each subject is in 'self.status':
+        'converged' (projected gradient below 'JOINT_GTOL', or decrease
+        of the objective below 'JOINT_FTOL') or 'failed' (no decrease
+        along the last step, or too many iterations), and the number of
+        iterations in 'self.n_iter'
+        :return: (best-fit parameters (n_subjects, n_param),
+        best values of the objective (n_subjects, ))
+        """
+
+        n, k = self.n_subjects, self.n_param
+        rows = np.arange(n)
+
+        self.status = np.full(n, 'failed', dtype=object)
+        self.n_iter = 0
+
+        if not k:
             assert self.model == Random
-            best_param = ()
-            best_value = self.objective(())
+            self.status[:] = 'converged'
+            return np.zeros((n, 0)), - self.log_likelihood(
+                np.zeros((n, 0)), rows)
+
+        u = np.full((n, k), 0.5)
+        f, g = self.objective(u, rows)
+        h = np.tile(np.eye(k), (n, 1, 1))  # Inverse Hessians
+        held = np.zeros((n, k), dtype=bool)
+
+        running = np.isfinite(f)
+
+        for _ in range(JOINT_MAX_ITER):
+
+            # Projected gradient: zero at an optimum within the bounds
+            pg = u - np.clip(u - g, 0, 1)
+            done = running & (np.max(np.abs(pg), axis=1) <= JOINT_GTOL)
+            self.status[done] = 'converged'
+            running &= ~done
+
+            if not np.any(running):
+                break
+            self.n_iter += 1
+
+            i = np.flatnonzero(running)
+
+            # Quasi-Newton direction on the parameters that are not
+            # held at a bound by the gradient (the inverse Hessian
+            # starts again when they change)
+            held_i = ((u[i] <= 0) & (g[i] > 0)) | ((u[i] >= 1) & (g[i] < 0))
+            h[i[np.any(held_i != held[i], axis=1)]] = np.eye(k)
+            held[i] = held_i
+
+            g_free = np.where(held_i, 0, g[i])
+            d = - np.einsum('nij,nj->ni', h[i], g_free)
+            d[held_i] = 0
+
+            # Not a descent direction: back to the steepest descent
+            reset = np.sum(d * g_free, axis=1) >= 0
+            d[reset] = - g_free[reset]
+            h[i[reset]] = np.eye(k)
+
+            # No step longer than the bounds
+            d /= np.maximum(1, np.max(np.abs(d), axis=1))[:, None]
+
+            # Backtracking line search (Armijo), in lockstep
+            step = np.ones(len(i))
+            u_new, f_new, g_new = u[i].copy(), f[i].copy(), g[i].copy()
+            pending = np.ones(len(i), dtype=bool)
+            for _ in range(30):
+                j = np.flatnonzero(pending)
+                u_try = np.clip(u[i[j]] + step[j, None] * d[j], 0, 1)
+                f_try, g_try = self.objective(u_try, i[j])
+                ok = f_try <= f[i[j]] + 1e-4 * np.sum(
+                    g[i[j]] * (u_try - u[i[j]]), axis=1)
+                u_new[j[ok]], f_new[j[ok]], g_new[j[ok]] = \
+                    u_try[ok], f_try[ok], g_try[ok]
+                pending[j[ok]] = False
+                step[j[~ok]] /= 2
+                if not np.any(pending):
+                    break
+
+            # No decrease found: stop where it is
+            running[i[pending]] = False
+
+            moved = ~pending
+            ok = i[moved]
+            decrease = f[ok] - f_new[moved]
+            s = u_new[moved] - u[ok]
+            y = np.where(held[ok], 0, g_new[moved] - g[ok])
+            u[ok], f[ok], g[ok] = u_new[moved], f_new[moved], g_new[moved]
+
+            # BFGS update of the inverse Hessians (if the curvature is
+            # positive along the step)
+            sy = np.sum(s * y, axis=1)
+            curved = sy > 1e-10
+            m, s, y = ok[curved], s[curved], y[curved]
+            rho = 1 / sy[curved]
+            a = np.eye(k) - rho[:, None, None] * s[:, :, None] * y[:, None, :]
+            h[m] = a @ h[m] @ np.swapaxes(a, 1, 2) \
+                + rho[:, None, None] * s[:, :, None] * s[:, None, :]
+
+            small = decrease <= JOINT_FTOL * np.maximum(
+                np.maximum(np.abs(f[ok]), np.abs(f[ok] + decrease)), 1)
+            self.status[ok[small]] = 'converged'
+            running[ok[small]] = False
+
+        return self.to_param(u), f
+
+
+@use_pickle(compress='zlib')
+def fit_population(model, choices, successes):
+
+    """
+    Joint fit of a model to the data of all the subjects
+    (see 'PopulationOptimizer')
+    :return: (best-fit parameters (n_subjects, n_param),
+    best values of the objective (n_subjects, ), status of each fit)
+    """
 
-        return best_param, best_value
+    opt = PopulationOptimizer(choices=choices,
+                              successes=successes,
+                              model=model)
+    best_param, best_value = opt.run()
+    return best_param, best_value, opt.status
 
 
 # ==========================================================================
@@ -493,18 +1641,14 @@ class BanditOptimizer:
 # ==========================================================================
 
 
-@use_pickle
 def get_best_param():
 
-    # Create optimizer
-    opt = BanditOptimizer(
+    # Run the optimization
+    best_param, best_value, status, spread = fit_model(
+        model=RW,
         choices=CHOICES_SINGLE,
-        successes=SUCCESSES_SINGLE,
-        model=RW
+        successes=SUCCESSES_SINGLE
     )
-
-    # Run the optimization
-    best_param, best_value = opt.run()
     return best_param
 
 
@@ -537,8 +1681,24 @@ plot.comparison_best_fit_rw_single(
 # Parameter space exploration =============================================
 # =========================================================================
 
-@use_pickle
-def parameter_space_exploration(model, choices, successes, grid_size=20):
+def log_likelihood_grid_chunk(idx, model, choices, successes, param, ll):
+
+    """
+    Log-likelihood of the parameter sets 'idx' (consecutive rows of
+    'param'), written in place in 'll' (see 'run_sim_chunk')
+    """
+
+    rows = slice(idx[0], idx[-1] + 1)
+    ll.array[rows] = log_likelihood_batch(model=model,
+                                          param=param.array[rows],
+                                          choices=choices,
+                                          successes=successes)
+    return idx
+
+
+@use_pickle(ignore=('executor', ))
+def parameter_space_exploration(model, choices, successes, grid_size=20,
+                                executor=None):
 
     """
     Compute likelihood for several combinations of parameters
@@ -566,23 +1726,18 @@ def parameter_space_exploration(model, choices, successes, grid_size=20):
             product(*parameter_values)
         ))
 
-    n_sets = len(param_grid)
-
-    # Container for log-likelihood
-    ll = np.zeros(n_sets)
-
-    # Loop over each value of the parameter grid for both parameters
-    for i in tqdm(range(n_sets)):
-
-        # Select the parameter to use
-        param_to_use = param_grid[i]
-
-        # Call the objective function of the optimizer
-        ll[i] = log_likelihood(
-            choices=choices,
-            successes=successes,
-            model=model,
-            param=param_to_use)
+    # Data container
+    ll = np.zeros(len(param_grid))
+
+    # Compute the log-likelihood of the points of the grid
+    # by chunks (each chunk at once)
+    executor = parallel.get(executor)
+    with executor.shared(param_grid, ll) as buffers:
+        executor.map_batches(
+            functools.partial(log_likelihood_grid_chunk, model=model,
+                              choices=choices, successes=successes,
+                              param=buffers[0], ll=buffers[1]),
+            range(len(param_grid)))
 
     return parameter_values, ll
 
@@ -640,13 +1795,37 @@ plot.comparison_best_fit_rw_pop(
 # PARAMETER RECOVERY =======================================================
 # ==========================================================================
 
-@use_pickle
-def data_param_recovery(model, n_sets, seed):
+def fit_simulation(call, model):
+
+    """
+    Fit a model to the data of a call to 'run_simulation'
+    :return: (best-fit parameters, status of the fit)
+    """
+
+    # Simulate
+    choices, successes = run_simulation(**call)
+
+    # Fit the model
+    best_param, best_value, status, spread = \
+        fit_model(model=model,
+                  choices=choices,
+                  successes=successes)
+    return best_param, status
+
+
+@use_pickle(pin=True, ignore=('executor', ))
+def data_param_recovery(model, n_sets, seed, executor=None):
+
+    """
+    :return: (array (n_param, 2 (simulated, retrieved), n_sets),
+    array (n_sets, ), status of each fit (see 'BanditOptimizer.run'))
+    """
 
     print("Computing data for parameter recovery...")
 
-    # Seed the random number generator
-    np.random.seed(seed)
+    # Independent seeds for each set
+    # (one for selecting the parameters, one for the simulation)
+    seeds = rng.spawn_seeds(seed, n_sets, 2)
 
     # Get the parameters labels
     param_labels = model.param_labels
@@ -655,35 +1834,41 @@ def data_param_recovery(model, n_sets, seed):
     # Data container (2: simulated, retrieved)
     param = np.zeros((n_param, 2, n_sets))
 
-    # Loop over the number of parameter sets
-    for set_idx in tqdm(range(n_sets)):
-
-        # Select parameter to simulate...
+    # Select parameters to simulate, so that the simulations
+    # of all the sets are loaded at once
+    calls = []
+    for set_idx in range(n_sets):
+        rng_set = rng.generator(seeds[set_idx, 0])
         param_to_sim = \
-            [np.random.uniform(*b)
+            [rng_set.uniform(*b)
              for b in model.fit_bounds]
+        param[:, 0, set_idx] = param_to_sim
+        calls.append(dict(seed=seeds[set_idx, 1], agent_model=model,
+                          param=param_to_sim))
 
-        # Simulate
-        choices, successes = run_simulation(seed=set_idx,
-                                            agent_model=model,
-                                            param=param_to_sim)
+    # Simulate and fit each set (saving the sets done as they come,
+    # so that a new run resumes from them). The fits are written to
+    # the cache at the end, in one go
+    with run_simulation.prefetch(calls), fit_model.prefetch():
+        fits = checkpoint.map_calls(
+            parallel.get(executor), fit_simulation,
+            [dict(call=c, model=model) for c in calls])
 
-        # Create the optimizer and run it
-        opt = BanditOptimizer(choices=choices,
-                              successes=successes,
-                              model=model)
-        best_param, best_value = opt.run()
+    # Backup
+    for set_idx in range(n_sets):
+        param[:, 1, set_idx] = fits[set_idx][0]
 
-        # Backup
-        for i in range(n_param):
-            param[i, 0, set_idx] = param_to_sim[i]
-            param[i, 1, set_idx] = best_param[i]
+    status = np.array([status for _, status in fits], dtype=object)
+    report_failures(status, outcome="their sets are left out")
 
-    return param
+    return param, status
 
 
 # Get data
-P_RCV = data_param_recovery(model=RW, n_sets=30, seed=234)
+P_RCV_ALL, STATUS_RCV = data_param_recovery(model=RW, n_sets=30, seed=234)
+
+# Leave out the sets whose fit failed
+P_RCV = P_RCV_ALL[:, :, STATUS_RCV != 'failed']
 
 # Plot
 plot.parameter_recovery(data=P_RCV,
@@ -702,23 +1887,24 @@ def bic(ll, k, n_iteration):
     return -2 * ll + k * np.log(n_iteration)
 
 
-def optimize_and_compare_single(choices, successes):
+def optimize_and_compare_single(choices, successes, models=MODELS):
 
-    n_models = len(MODELS)
+    n_models = len(models)
     bic_scores = np.zeros(n_models)
     lls = np.zeros(n_models)
     best_params = []
+    status = []
 
     for j in range(n_models):
 
         # Select the model
-        model_to_fit = MODELS[j]
+        model_to_fit = models[j]
 
-        # Create the optimizer and run it
-        opt = BanditOptimizer(choices=choices,
-                              successes=successes,
-                              model=model_to_fit)
-        best_param, best_value = opt.run()
+        # Fit the model (or get the cached fit)
+        best_param, best_value, fit_status, spread = \
+            fit_model(model=model_to_fit,
+                      choices=choices,
+                      successes=successes)
 
         # Get log-likelihood for best param
         ll = -best_value
@@ -730,17 +1916,20 @@ def optimize_and_compare_single(choices, successes):
         bic_scores[j] = bs
         lls[j] = ll
         best_params.append(best_param)
+        status.append(fit_status)
 
-    return best_params, lls, bic_scores
+    return best_params, lls, bic_scores, status
 
 
 @use_pickle
 def comparison_single_subject():
 
-    best_params, lls, bic_scores = \
+    best_params, lls, bic_scores, status = \
         optimize_and_compare_single(
             choices=CHOICES_SINGLE, successes=SUCCESSES_SINGLE)
 
+    report_failures(status)
+
     print(f"Model used: {MODEL_XP.__name__}")
     print("-" * 10)
 
@@ -758,61 +1947,98 @@ comparison_single_subject()
 # Confusion matrix ===========================================================
 # ============================================================================
 
-@use_pickle
-def data_confusion_matrix(models, n_sets):
+def compare_simulation(call, models):
+
+    """
+    Compare models on the data of a call to 'run_simulation'
+    :return: (bic score of each model, status of each fit)
+    """
+
+    # Simulate
+    choices, successes = run_simulation(**call)
+
+    # Compute bic scores
+    best_params, lls, bic_scores, status = \
+        optimize_and_compare_single(choices=choices,
+                                    successes=successes,
+                                    models=models)
+    return bic_scores, status
+
+
+@use_pickle(pin=True, ignore=('executor', ))
+def data_confusion_matrix(models, n_sets, seed, executor=None):
+
+    """
+    The sets for which a fit failed are left out of the matrix
+    :return: (array (n_models, n_models), number of sets of each
+    simulated model (row) classified as each fitted model (column),
+    array (n_models, n_sets, n_models), status of each fit
+    (see 'BanditOptimizer.run'))
+    """
+
     print("Computing data for confusion matrix...")
 
     # Number of models
     n_models = len(models)
 
+    # Independent seeds for each set of each model
+    # (one for selecting the parameters, one for the simulation)
+    seeds = rng.spawn_seeds(seed, n_models, n_sets, 2)
+
     # Data container
     confusion_matrix = np.zeros((n_models, n_models))
 
-    # Loop over each model
-    with tqdm(total=n_models * n_sets) as pbar:
-        for i in range(n_models):
+    # Select parameters to simulate (as in 'data_param_recovery')
+    calls = []
+    for i in range(n_models):
+        for j in range(n_sets):
+            rng_set = rng.generator(seeds[i, j, 0])
+            param_to_sim = \
+                [rng_set.uniform(*b)
+                 for b in models[i].fit_bounds]
+            calls.append(dict(seed=seeds[i, j, 1],
+                              agent_model=models[i],
+                              param=param_to_sim))
 
-            # Select the model
-            model_to_sim = models[i]
+    # Simulate each set and compute the bic scores of every model
+    # (as in 'data_param_recovery')
+    with run_simulation.prefetch(calls), fit_model.prefetch():
+        comparisons = checkpoint.map_calls(
+            parallel.get(executor), compare_simulation,
+            [dict(call=c, models=models) for c in calls])
 
-            for j in range(n_sets):
-                # Select parameters to simulate
-                param_to_sim = \
-                    [np.random.uniform(*b)
-                     for b in model_to_sim.fit_bounds]
+    status = np.reshape(np.array([s for _, s in comparisons], dtype=object),
+                        (n_models, n_sets, n_models))
+    report_failures(status, outcome="their sets are left out")
 
-                # Simulate
-                choices, successes = \
-                    run_simulation(
-                        seed=j,
-                        agent_model=model_to_sim,
-                        param=param_to_sim)
+    bic_scores = np.reshape([bic for bic, _ in comparisons],
+                            (n_models, n_sets, n_models))
 
-                # Compute bic scores
-                best_params, lls, bic_scores = \
-                    optimize_and_compare_single(choices=choices,
-                                                successes=successes)
+    for i in range(n_models):
+        for j in range(n_sets):
 
-                # Get minimum value for bic (min => best)
-                min_ = np.min(bic_scores)
+            # Skip the sets for which a fit failed
+            if np.any(status[i, j] == 'failed'):
+                continue
 
-                # Get index of models that get best bic
-                idx_min = np.arange(n_models)[bic_scores == min_]
+            # Get minimum value for bic (min => best)
+            min_ = np.min(bic_scores[i, j])
 
-                # Add result in matrix
-                confusion_matrix[i, idx_min] += 1 / len(idx_min)
+            # Get index of models that get best bic
+            idx_min = np.arange(n_models)[bic_scores[i, j] == min_]
 
-                # Update progress bar
-                pbar.update(1)
+            # Add result in matrix
+            confusion_matrix[i, idx_min] += 1 / len(idx_min)
 
-    return confusion_matrix
+    return confusion_matrix, status
 
 
 # Data
 N_SETS_CONF = 100
 SEED_CONF = 123
-np.random.seed(SEED_CONF)
-CONF_MT = data_confusion_matrix(models=MODELS, n_sets=N_SETS_CONF)
+CONF_MT, CONF_STATUS = data_confusion_matrix(models=MODELS,
+                                             n_sets=N_SETS_CONF,
+                                             seed=SEED_CONF)
 
 # Plot
 plot.confusion_matrix(data=CONF_MT, tick_labels=MODEL_NAMES)
@@ -827,13 +2053,13 @@ stats.classification(CONF_MT, model_names=MODEL_NAMES)
 
 # Get data
 SEED_HET_POP = 1234
-np.random.seed(SEED_HET_POP)
+RNG_HET_POP = rng.generator(SEED_HET_POP)
 
 RW_HET_POP_DIST_PARAM = (0.15, 0.05), (10.0, 0.5)
 
 PARAM_HET_POP = \
     [
-        [np.random.normal(*p) for p in RW_HET_POP_DIST_PARAM]
+        [RNG_HET_POP.normal(*p) for p in RW_HET_POP_DIST_PARAM]
         for _ in range(N_SUBJECTS)
     ]
 
@@ -845,23 +2071,113 @@ plot.behavior_pop(choices=CHOICES_HET_POP, successes=SUCCESSES_HET_POP,
                   n_option=N)
 
 
-@use_pickle
-def optimize_and_compare_pop(choices, successes):
+def optimize_and_compare_subject(i, models, choices, successes,
+                                 lls, bic_scores):
+
+    """
+    Optimize and compare for subject i, and write its log-likelihoods
+    and bic scores in place (see 'run_sim_chunk')
+    :return: (best-fit parameters of each model, status of each fit)
+    """
+
+    best_params, lls.array[i], bic_scores.array[i], status = \
+        optimize_and_compare_single(choices=choices.array[i],
+                                    successes=successes.array[i],
+                                    models=models)
+    return best_params, status
+
+
+def optimize_and_compare_joint(choices, successes, models, lls,
+                               bic_scores):
+
+    """
+    Same as 'optimize_and_compare_subject' for all the subjects at once,
+    with a joint fit of each model (see 'fit_population'). The subjects
+    whose joint fit fails are fitted again on their own
+    :return: (list of the best-fit parameters of each model for each
+    subject, array of the status of each fit (n_subjects, n_models))
+    """
 
     n_subjects = len(choices)
+    best_params = [[] for _ in range(n_subjects)]
+    status = np.zeros((n_subjects, len(models)), dtype=object)
 
-    # Data containers
-    best_parameters = np.zeros(n_subjects, dtype=object)
-    lls = np.zeros((n_subjects, len(MODELS)))
-    bic_scores = np.zeros((n_subjects, len(MODELS)))
+    for j, model in enumerate(models):
+
+        param, values, status[:, j] = fit_population(
+            model=model, choices=choices, successes=successes)
+        values = np.array(values)
+
+        for i in range(n_subjects):
+            if status[i, j] == 'failed':
+                param_i, values[i], status[i, j], spread = fit_model(
+                    model=model, choices=choices[i], successes=successes[i])
+            elif model.fit_bounds:
+                param_i = param[i]
+            else:  # As returned by 'fit_model'
+                param_i = ()
+
+            best_params[i].append(param_i)
 
-    # Loop over subjects
-    for i in tqdm(range(n_subjects)):
+        lls[:, j] = - values
+        bic_scores[:, j] = bic(lls[:, j], k=len(model.fit_bounds),
+                               n_iteration=T)
 
-        # Optimize and compare
-        best_parameters[i], lls[i], bic_scores[i] = \
-            optimize_and_compare_single(choices=choices[i],
-                                        successes=successes[i])
+    return best_params, status
+
+
+def optimize_and_compare_pop(choices, successes, models=MODELS,
+                             executor=None, joint=False):
+
+    """
+    Assembled from the fit of each model to each subject (see
+    'fit_model'): adding a model or a subject only fits the new pairs.
+    With 'joint', each model is fitted to all the subjects at once
+    (see 'fit_population'), which amortizes the cost of each step of
+    the optimizer over the population. The joint fits are cached for
+    each (model, population) pair and don't reuse the fits of the
+    subjects: adding a subject fits the whole population again.
+    'executor' is only used without 'joint'
+    """
+
+    assert not (joint and executor is not None), \
+        "The joint fits don't use an executor"
+
+    n_subjects = len(choices)
+
+    # Data containers
+    best_parameters = np.zeros(n_subjects, dtype=object)
+    lls = np.zeros((n_subjects, len(models)))
+    bic_scores = np.zeros((n_subjects, len(models)))
+    fit_status = np.zeros((n_subjects, len(models)), dtype=object)
+
+    if joint:
+        results, fit_status[:] = optimize_and_compare_joint(
+            choices=choices, successes=successes, models=models,
+            lls=lls, bic_scores=bic_scores)
+        for i in range(n_subjects):
+            best_parameters[i] = results[i]
+
+    else:
+        # Load the fits already done at once
+        fits = [dict(model=m, choices=choices[i], successes=successes[i])
+                for i in range(n_subjects) for m in models]
+
+        # Optimize and compare for each subject
+        executor = parallel.get(executor)
+        with executor.shared(choices, successes, lls, bic_scores) \
+                as buffers, fit_model.prefetch(fits):
+            results = executor.map(
+                functools.partial(optimize_and_compare_subject,
+                                  models=models,
+                                  choices=buffers[0], successes=buffers[1],
+                                  lls=buffers[2], bic_scores=buffers[3]),
+                range(n_subjects))
+
+        for i in range(n_subjects):
+            best_parameters[i], fit_status[i] = results[i]
+
+    report_failures(fit_status)
 
     # Freq and confidence intervals for the barplot
     lls_freq, lls_err = stats.freq_and_err(lls)
@@ -869,13 +2185,13 @@ def optimize_and_compare_pop(choices, successes):
 
     return lls, lls_freq, lls_err,\
         bic_scores, bic_freq, bic_err, \
-        best_parameters
+        best_parameters, fit_status
 
 
 # Get data
 LLS_HET, LLS_FREQ_HET, LLS_ERR_HET, \
     BIC_HET, BIC_FQ_HT, BIC_ERR_HET,\
-    PARAM_HET_BF = \
+    PARAM_HET_BF, FIT_STATUS_HET = \
     optimize_and_compare_pop(choices=CHOICES_HET_POP,
                              successes=SUCCESSES_HET_POP)
 
@@ -897,17 +2213,23 @@ BEST_MODEL = MODELS[BEST_MODEL_IDX]
 # Assume that it should be the one that you used to simulate
 assert MODEL_XP == BEST_MODEL
 
+# Leave out the subjects whose fit of the best model failed
+# (their parameters may be undefined)
+report_failures(FIT_STATUS_HET[:, BEST_MODEL_IDX],
+                outcome="their subjects are left out of the simulation")
+FIT_OK_HET = FIT_STATUS_HET[:, BEST_MODEL_IDX] != 'failed'
+
 # Retrieve parameters for best model
 PARAM_HET_BF_BEST_MODEL = np.asarray(
     [
         PARAM_HET_BF[i][BEST_MODEL_IDX]
-        for i in range(N_SUBJECTS)
+        for i in np.flatnonzero(FIT_OK_HET)
     ])
 
 # Get behavior for best-fit
 CHOICES_HET_BF, SUCCESSES_HET_BF = \
     run_sim_pop(model=RW, param=PARAM_HET_BF_BEST_MODEL,
-                n_subjects=N_SUBJECTS)
+                n_subjects=len(PARAM_HET_BF_BEST_MODEL))
 
 # Get latent variables values
 Q_VALUES_HET_BF, P_CHOICES_HET_BF = \
@@ -916,8 +2238,8 @@ Q_VALUES_HET_BF, P_CHOICES_HET_BF = \
                             param=PARAM_HET_BF_BEST_MODEL)
 
 plot.post_hoc_sim(
-    choices=CHOICES_HET_POP,
-    successes=SUCCESSES_HET_POP,
+    choices=CHOICES_HET_POP[FIT_OK_HET],
+    successes=SUCCESSES_HET_POP[FIT_OK_HET],
     choices_bf=CHOICES_HET_BF,
     successes_bf=SUCCESSES_HET_BF,
     q_values_bf=Q_VALUES_HET_BF,
@@ -0,0 +1,77 @@
+import os
+import ast
+import sys
+import types
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utils.jit as jit  # noqa: E402
+
+
+def load_draft():
+
+    """
+    Definitions of 'draft.py' (imports, constants, functions and
+    classes), without the steps of the script
+    :return: module
+    """
+
+    f_name = os.path.join(ROOT, "draft.py")
+    with open(f_name) as f:
+        tree = ast.parse(f.read())
+
+    defined = {node.name for node in tree.body
+               if isinstance(node, (ast.FunctionDef, ast.ClassDef))}
+
+    # Steps of the script (calls to its functions), and what depends
+    # on their results
+    body = []
+    computed = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import) and any(
+                a.name.split('.')[0] in ('plot', 'stats') for a in node.names):
+            continue  # Figures and statistics of the lecture
+        if isinstance(node, (ast.Import, ast.ImportFrom,
+                             ast.FunctionDef, ast.ClassDef)):
+            body.append(node)
+        elif isinstance(node, ast.Assign):
+            calls = {n.func.id for n in ast.walk(node.value)
+                     if isinstance(n, ast.Call)
+                     and isinstance(n.func, ast.Name)}
+            names = {n.id for n in ast.walk(node.value)
+                     if isinstance(n, ast.Name)}
+            if calls & defined or names & computed:
+                computed.update(n.id for t in node.targets
+                                for n in ast.walk(t)
+                                if isinstance(n, ast.Name))
+            else:
+                body.append(node)
+
+    # Removed from recent versions of NumPy
+    if not hasattr(np, 'float'):
+        np.float = float
+
+    # Registered, for Numba to find the globals of the cached kernels
+    module = sys.modules["draft"] = types.ModuleType("draft")
+    module.__file__ = f_name
+    exec(compile(ast.Module(body=body, type_ignores=[]), f_name, 'exec'),
+         module.__dict__)
+    return module
+
+
+@pytest.fixture(scope="session")
+def draft():
+    return load_draft()
+
+
+@pytest.fixture(params=jit.BACKENDS if jit.numba is not None
+                else ("numpy", ))
+def backend(request):
+    previous = jit.get_backend()
+    jit.set_backend(request.param)
+    yield request.param
+    jit.set_backend(previous)
@@ -0,0 +1,53 @@
+import os
+import time
+import multiprocessing
+
+import pytest
+
+import utils.cache.files as files
+import utils.cache.evict as evict
+
+pytestmark = pytest.mark.skipif(
+    files.fcntl is None or
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="locks between processes need fcntl and fork")
+
+
+def hold_lock(folder, locked, release):
+    with files.locked(folder):
+        locked.set()
+        release.wait()
+
+
+def test_global_budget_waits_for_writers(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    folder = os.path.join(files.BKP_FOLDER, "func")
+    os.makedirs(folder)
+    files.write_entry(folder, "ab" * 20, data=list(range(100)), info={})
+
+    context = multiprocessing.get_context("fork")
+    locked, release = context.Event(), context.Event()
+    writer = context.Process(target=hold_lock,
+                             args=(folder, locked, release))
+    writer.start()
+    try:
+        assert locked.wait(10)
+
+        # The folder is locked by the writer: nothing is removed
+        # until it releases it
+        evictor = context.Process(target=evict.enforce_disk_budget,
+                                  kwargs=dict(max_bytes=0))
+        evictor.start()
+        time.sleep(0.5)
+        assert evictor.is_alive()
+        assert evict.scan(folder)
+
+        release.set()
+        evictor.join(10)
+        assert evictor.exitcode == 0
+        assert not evict.scan(folder)
+
+    finally:
+        release.set()
+        writer.join(10)
@@ -0,0 +1,35 @@
+import numpy as np
+
+import pytest
+
+from utils.decorator import use_pickle
+import utils.cache.shards as shards
+import utils.cache.memory as memory
+import utils.cache.stats as cache_stats
+import utils.executor as parallel
+import utils.rng as rng
+
+
+@use_pickle(compress='zlib', shards=4)
+def draw_choices(seed):
+    return rng.generator(seed).integers(2, size=100)
+
+
+@pytest.mark.parametrize("backend", parallel.BACKENDS)
+def test_worker_counters_are_merged(backend, tmp_path, monkeypatch):
+
+    # New cache (its folder is relative to the working directory)
+    monkeypatch.chdir(tmp_path)
+    memory.MEMORY.clear()
+    shards._shard_indexes.clear()
+    draw_choices.stats.reset()
+
+    calls = [dict(seed=seed) for seed in range(40)]
+    executor = parallel.Executor(backend=backend, n_workers=4,
+                                 progress=False)
+    outputs = [executor.map_calls(draw_choices, calls) for _ in range(2)]
+
+    counts = cache_stats.get_stats('draw_choices')
+    assert (counts['calls'], counts['misses'],
+            counts['memory_hits'] + counts['disk_hits']) == (80, 40, 40)
+    assert all(np.array_equal(a, b) for a, b in zip(*outputs))
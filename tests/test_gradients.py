@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import utils.jit as jit
+
+
+def data(draft, n_sets=1, seed=0):
+    gen = np.random.default_rng(seed)
+    choices = gen.integers(draft.N, size=(n_sets, draft.T))
+    successes = gen.random((n_sets, draft.T)) < 0.6
+    return choices, successes
+
+
+def params(model, n_sets, seed=0):
+    bounds = np.array(model.fit_bounds).reshape(-1, 2)
+    return np.random.default_rng(seed).uniform(
+        bounds[:, 0], bounds[:, 1], size=(n_sets, len(bounds)))
+
+
+@pytest.mark.parametrize("name", ["Random", "WSLS", "RW", "RWCK"])
+def test_log_likelihood_paths_agree(draft, backend, name):
+
+    model = getattr(draft, name)
+    choices, successes = data(draft, n_sets=3)
+    param = params(model, n_sets=3)
+
+    ll_batch = draft.log_likelihood_batch(model, param, choices, successes)
+    ll = [draft.log_likelihood(model, p, c, s)
+          for p, c, s in zip(param, choices, successes)]
+
+    assert np.allclose(ll, ll_batch)
+
+
+@pytest.mark.parametrize("name", ["RW", "RWCK"])
+def test_gradient_follows_likelihood(draft, backend, name):
+
+    model = getattr(draft, name)
+    choices, successes = data(draft, n_sets=3)
+    param = params(model, n_sets=3)
+
+    ll = draft.log_likelihood_batch(model, param, choices, successes)
+    ll_batch, grad_batch = draft.log_likelihood_grad_batch(
+        model, param, choices, successes)
+    assert np.allclose(ll_batch, ll)
+
+    for i in range(len(param)):
+        ll_i, grad_i = draft.log_likelihood_and_grad(
+            model, param[i], choices[i], successes[i])
+        assert np.isclose(ll_i, ll[i])
+        assert np.allclose(grad_i, grad_batch[i])
+
+
+@pytest.mark.parametrize("name", ["RW", "RWCK"])
+def test_gradient_matches_finite_differences(draft, name):
+
+    model = getattr(draft, name)
+    choices, successes = data(draft)
+    param = params(model, n_sets=1)
+
+    _, grad = draft.log_likelihood_grad_batch(model, param,
+                                              choices, successes)
+
+    step = 1e-6
+    for k in range(param.shape[1]):
+        up, down = param.copy(), param.copy()
+        up[0, k] += step
+        down[0, k] -= step
+        diff = (draft.log_likelihood_batch(model, up, choices, successes)
+                - draft.log_likelihood_batch(model, down, choices, successes)
+                ) / (2 * step)
+        assert np.isclose(grad[0, k], diff[0], rtol=1e-5, atol=1e-6)
+
+
+def test_python_kernels_dont_compile(draft):
+
+    kernel = jit.python(draft.kernel_log_likelihood_grad)
+    assert kernel.__globals__['kernel_decision_rule'] \
+        is not draft.kernel_decision_rule or jit.numba is None
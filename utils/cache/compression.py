@@ -0,0 +1,69 @@
+import bz2
+import lzma
+import zlib
+import numpy as np
+
+# Codecs available for the compression of entries
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress)
+}
+
+
+class PackedArray:
+
+    """
+    Compact form of an array before compression: booleans are packed
+    8 per byte, and integers are stored in the smallest type that holds
+    their values
+    """
+
+    def __init__(self, a):
+
+        self.dtype = a.dtype.str
+        self.shape = a.shape
+
+        if a.dtype == bool:
+            self.values = np.packbits(a.ravel())
+        else:
+            small = np.result_type(np.min_scalar_type(a.min()),
+                                   np.min_scalar_type(a.max()))
+            self.values = a.astype(small)
+
+    def unpack(self):
+
+        if np.dtype(self.dtype) == bool:
+            n = int(np.prod(self.shape))
+            return np.unpackbits(self.values, count=n)\
+                .astype(bool).reshape(self.shape)
+
+        return self.values.astype(self.dtype)
+
+
+def pack(obj):
+
+    """
+    Replace the boolean and integer arrays in 'obj' (possibly nested in
+    tuples, lists or dicts) by their compact form (see 'PackedArray')
+    """
+
+    if isinstance(obj, np.ndarray) and obj.size \
+            and (obj.dtype == bool or obj.dtype.kind in 'iu'):
+        return PackedArray(obj)
+    if type(obj) in (tuple, list):
+        return type(obj)(pack(v) for v in obj)
+    if type(obj) is dict:
+        return {k: pack(v) for k, v in obj.items()}
+    return obj
+
+
+def unpack(obj):
+
+    if isinstance(obj, PackedArray):
+        return obj.unpack()
+    if type(obj) in (tuple, list):
+        return type(obj)(unpack(v) for v in obj)
+    if type(obj) is dict:
+        return {k: unpack(v) for k, v in obj.items()}
+    return obj
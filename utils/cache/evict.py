@@ -0,0 +1,118 @@
+import os
+import contextlib
+
+from utils.cache.files import BKP_FOLDER, locked
+
+# Budget (in bytes) for the whole cache folder (None: no limit)
+MAX_BYTES = None
+
+# Marker of the folders of functions whose entries are never evicted
+PIN_FILE = ".pinned"
+
+
+def set_disk_budget(max_bytes):
+
+    """
+    Set the maximum size of the cache folder. Beyond it, the least
+    recently used entries of the functions that are not pinned
+    are evicted
+    :param max_bytes: int or None (no limit)
+    """
+
+    global MAX_BYTES
+    MAX_BYTES = max_bytes
+
+
+def scan(folder):
+
+    """
+    List the entries of the folder of a function
+    :param folder: string
+    :return: dict {key: {'size': int, 'last_access': float,
+    'files': list of string}}
+    """
+
+    entries = {}
+
+    for f in os.scandir(folder):
+        if f.name.startswith('.'):  # Lock, marker or file being written
+            continue
+        try:
+            stat = f.stat()
+        except FileNotFoundError:  # Evicted meanwhile
+            continue
+
+        key = f.name.split('_', 1)[0]
+        entry = entries.setdefault(
+            key, {'size': 0, 'last_access': 0., 'files': []})
+        entry['size'] += stat.st_size
+        entry['last_access'] = max(entry['last_access'], stat.st_mtime)
+        entry['files'].append(f.path)
+
+    return entries
+
+
+def evict(entries, max_bytes, keep=()):
+
+    """
+    Remove the least recently used entries until their total size
+    is lower than 'max_bytes'
+    :param entries: dict, as returned by 'scan'
+    :param max_bytes: int
+    :param keep: keys of entries that should not be removed
+    :return: int, number of bytes that remain
+    """
+
+    total = sum(e['size'] for e in entries.values())
+
+    for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+
+        # Remove first the file that publishes the entry (see
+        # 'write_entry'): once it is gone, the entry is a miss
+        for f_name in sorted(entries[key]['files'],
+                             key=lambda f: (not f.endswith('_data.p'),
+                                            '_info' not in f)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f_name)
+
+        total -= entries[key]['size']
+
+    return total
+
+
+def enforce_disk_budget(max_bytes=None, keep=()):
+
+    """
+    Evict entries of the functions that are not pinned until the cache
+    folder fits in 'max_bytes' (by default, the global budget)
+    :param keep: keys of entries that should not be removed
+    """
+
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    if max_bytes is None or not os.path.isdir(BKP_FOLDER):
+        return
+
+    # Writers only hold the lock of their own folder: hold the lock of
+    # every folder whose files may be removed (always in the same order)
+    with locked(BKP_FOLDER), contextlib.ExitStack() as stack:
+
+        entries = {}
+        pinned_bytes = 0
+
+        for f in sorted(os.scandir(BKP_FOLDER), key=lambda f: f.name):
+            if not f.is_dir():
+                continue
+            if os.path.exists(os.path.join(f.path, PIN_FILE)):
+                pinned_bytes += sum(e['size']
+                                    for e in scan(f.path).values())
+            else:
+                stack.enter_context(locked(f.path))
+                entries.update({(f.name, k): e
+                                for k, e in scan(f.path).items()})
+
+        evict(entries, max_bytes=max_bytes - pinned_bytes, keep=keep)
@@ -0,0 +1,210 @@
+import os
+import pickle
+import tempfile
+import threading
+import contextlib
+import numpy as np
+
+from utils.cache.compression import CODECS, pack, unpack
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: lock between threads only
+    fcntl = None
+
+BKP_FOLDER = os.path.join("bkp", "run")
+
+# Prefix of the files being written (never read as cache entries)
+TMP_PREFIX = ".tmp_"
+
+# Below this size, arrays are pickled rather than memory-mapped
+# (mapping a file costs more than reading a few pages)
+NPY_MIN_BYTES = 256 * 1024
+
+_thread_lock = threading.RLock()
+
+
+@contextlib.contextmanager
+def locked(folder):
+
+    """
+    Exclusive lock on a cache folder, between threads and between
+    processes of the same machine
+    :param folder: string
+    """
+
+    with _thread_lock:
+        with open(os.path.join(folder, ".lock"), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def atomic_write(f_name, write):
+
+    """
+    Write a temporary file, then move it to 'f_name',
+    so that readers see either no file or the complete one
+    :param f_name: string
+    :param write: function taking a binary file object
+    """
+
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(f_name),
+                                    prefix=TMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, f_name)
+
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def atomic_dump(obj, f_name):
+    atomic_write(f_name, lambda f: pickle.dump(obj, f))
+
+
+def touch(f_name):
+
+    """
+    Register an access to a file (for the eviction of old entries,
+    see 'utils.cache.evict.scan'), if it exists
+    """
+
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(f_name)
+
+
+def as_arrays(data):
+
+    """
+    Arrays that make 'data', if it is an array or a tuple of arrays
+    that can be stored in the .npy format (and are large enough
+    to be worth memory-mapping)
+    :return: list of arrays, or None
+    """
+
+    arrays = list(data) if type(data) is tuple else [data]
+    if all(isinstance(a, np.ndarray) and not a.dtype.hasobject
+           for a in arrays) \
+            and sum(a.nbytes for a in arrays) >= NPY_MIN_BYTES:
+        return arrays
+    return None
+
+
+def write_entry(folder, key, data, info, codec=None, stats=None):
+
+    """
+    Write the files of an entry (to be called under the lock of the
+    folder).
+    * With a codec, the data are packed (see
+    'utils.cache.compression.pack'), pickled and compressed, and the
+    info file, written last, publishes the entry.
+    * Otherwise, arrays and tuples of arrays are saved as .npy files, and
+    the info file, written last, publishes the entry. Other objects are
+    pickled, and the data file, written last, publishes the entry.
+    :param info: dict, information about the call
+    :param codec: None or key of 'CODECS'
+    :param stats: CacheStats or None, counts the bytes written
+    :return: int, size of the data (in bytes, before compression)
+    """
+
+    def file_name(suffix, ext='p'):
+        return os.path.join(folder, f"{key}_{suffix}.{ext}")
+
+    arrays = as_arrays(data)
+
+    if codec is not None:
+        compress, _ = CODECS[codec]
+        raw = pickle.dumps(pack(data), protocol=4)
+        files = [file_name('data', ext=codec), file_name('info')]
+        atomic_write(files[0], lambda f: f.write(compress(raw)))
+        atomic_dump(dict(info, format='packed', codec=codec,
+                         raw_bytes=len(raw)), files[1])
+        size = len(raw)
+
+    elif arrays is None:
+        files = [file_name('info'), file_name('data')]
+        atomic_dump(dict(info, format='pickle'), files[0])
+        atomic_dump(data, files[1])
+
+    else:
+        files = [file_name(f'data_{i}', ext='npy')
+                 for i in range(len(arrays))] + [file_name('info')]
+        for a, f_name in zip(arrays, files):
+            atomic_write(f_name, lambda f: np.save(f, a))
+        atomic_dump(dict(info, format='npy', n_arrays=len(arrays),
+                         is_tuple=type(data) is tuple), files[-1])
+
+    n_bytes = sum(os.path.getsize(f) for f in files)
+    if stats is not None:
+        stats.add(bytes_written=n_bytes)
+
+    return size if codec is not None else n_bytes
+
+
+def read_entry(folder, key, stats=None):
+
+    """
+    Read an entry. Arrays are memory-mapped (read-only), so nothing
+    is read until they are used, and processes share the same pages
+    :param stats: CacheStats or None, counts the bytes read
+    :return: (True, data, size) for a hit (size in bytes,
+    before compression), (False, None, 0) for a miss
+    """
+
+    def file_name(suffix, ext='p'):
+        return os.path.join(folder, f"{key}_{suffix}.{ext}")
+
+    def load(f_name):
+        with open(f_name, 'rb') as f:
+            return pickle.load(f)
+
+    try:
+        data_file = file_name('data')
+        info = {}
+        try:
+            data = load(data_file)
+            files = [data_file]
+
+        except FileNotFoundError:
+            info_file = file_name('info')
+            info = load(info_file)
+
+            if info.get('format') == 'npy':
+                files = [file_name(f'data_{i}', ext='npy')
+                         for i in range(info['n_arrays'])]
+                arrays = [np.load(f, mmap_mode='r') for f in files]
+                data = tuple(arrays) if info['is_tuple'] else arrays[0]
+                files.append(info_file)
+
+            elif info.get('format') == 'packed':
+                _, decompress = CODECS[info['codec']]
+                files = [file_name('data', ext=info['codec']), info_file]
+                with open(files[0], 'rb') as f:
+                    data = unpack(pickle.loads(decompress(f.read())))
+
+            else:  # Data being written
+                return False, None, 0
+
+        # Register the access (for the eviction of old entries)
+        os.utime(files[-1])
+
+        n_bytes = sum(os.path.getsize(f) for f in files)
+        if stats is not None:
+            stats.add(bytes_read=n_bytes)
+
+        if info.get('format') == 'packed':
+            return True, data, info['raw_bytes']
+        return True, data, n_bytes
+
+    except FileNotFoundError:  # No entry (or evicted meanwhile)
+        return False, None, 0
@@ -0,0 +1,127 @@
+import os
+import pickle
+import hashlib
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Above this size, array buffers are hashed by chunks, in parallel
+# (hashlib releases the GIL)
+CHUNK_SIZE = 4 * 1024 ** 2
+
+_hash_pool = None
+
+
+def reset_hash_pool():
+
+    """
+    A forked process inherits the pool without its threads:
+    it has to create its own
+    """
+
+    global _hash_pool
+    _hash_pool = None
+
+
+if hasattr(os, 'register_at_fork'):  # Not available on Windows (no fork)
+    os.register_at_fork(after_in_child=reset_hash_pool)
+
+
+def hash_buffer(buffer):
+
+    """
+    Hash a (large) contiguous buffer without copying it
+    :param buffer: object supporting the buffer protocol
+    :return: bytes (digest)
+    """
+
+    global _hash_pool
+
+    buffer = memoryview(buffer).cast('B')
+    n_bytes = buffer.nbytes
+
+    if n_bytes <= 2 * CHUNK_SIZE:
+        return hashlib.sha1(buffer).digest()
+
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    chunks = [buffer[i:i + CHUNK_SIZE]
+              for i in range(0, n_bytes, CHUNK_SIZE)]
+    digests = _hash_pool.map(lambda c: hashlib.sha1(c).digest(), chunks)
+    return hashlib.sha1(b''.join(digests)).digest()
+
+
+def fingerprint(obj, h):
+
+    """
+    Feed the hash 'h' with the content of 'obj'. Arguments that are equal
+    give the same fingerprint. Arrays are hashed from their buffer
+    (plus dtype and shape), without any loop over their elements
+    :param obj: array, scalar, string, (nested) list/tuple/dict,
+    class, function or any picklable object
+    :param h: hashlib object
+    """
+
+    def tag(*fields):
+        for field in fields:
+            field = str(field).encode()
+            h.update(len(field).to_bytes(8, 'little') + field)
+
+    if isinstance(obj, np.ndarray):
+        tag('ndarray', obj.dtype.str, obj.shape)
+        if obj.dtype.hasobject:
+            for v in obj.ravel():
+                fingerprint(v, h)
+        else:
+            h.update(hash_buffer(
+                np.ascontiguousarray(obj).reshape(-1).view(np.uint8)))
+
+    elif isinstance(obj, np.generic):
+        fingerprint(obj.item(), h)
+
+    elif isinstance(obj, (list, tuple)):
+        tag('seq', len(obj))
+        for v in obj:
+            fingerprint(v, h)
+
+    elif isinstance(obj, dict):
+        tag('dict', len(obj))
+        for k in sorted(obj, key=repr):
+            tag(repr(k))
+            fingerprint(obj[k], h)
+
+    # Classes and functions are identified by their names
+    elif inspect.isclass(obj) or inspect.isfunction(obj):
+        tag('named', obj.__module__, obj.__qualname__)
+
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        tag(type(obj).__name__, repr(obj))
+
+    else:
+        tag('pickle')
+        h.update(hashlib.sha1(pickle.dumps(obj, protocol=4)).digest())
+
+
+def call_key(func, args, kwargs, ignore=()):
+
+    """
+    Key of a call, derived from the identity of the function
+    and from its arguments (positional or not)
+    :param ignore: names of the arguments that don't change the output
+    (and are left out of the key)
+    :return: string (hexadecimal hash)
+    """
+
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+
+    h = hashlib.sha1()
+    fingerprint(func, h)
+    for k, v in bound.arguments.items():
+        if k in ignore:
+            continue
+        fingerprint(k, h)
+        fingerprint(v, h)
+
+    return h.hexdigest()
@@ -0,0 +1,132 @@
+import copy
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def freeze(obj):
+
+    """
+    Read-only version of 'obj', if it is made only of arrays,
+    tuples and immutable scalars
+    :return: read-only object, or None if 'obj' can't be frozen
+    """
+
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return None
+        view = obj.view()
+        view.flags.writeable = False
+        return view
+
+    if type(obj) is tuple:
+        items = tuple(freeze(v) for v in obj)
+        if any(f is None and v is not None for f, v in zip(items, obj)):
+            return None
+        return items
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str,
+                                       bytes, np.generic)):
+        return obj
+
+    return None
+
+
+class MemoryCache:
+
+    """
+    In-process tier in front of the files, bounded by a number
+    of entries and a number of bytes (least recently used entries
+    are dropped first).
+    Arrays are stored (and returned) read-only; other mutable objects
+    are copied at each hit, so that callers can't alter the cache
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=512 * 1024 ** 2):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+
+        """
+        :return: (True, object) for a hit, (False, None) for a miss
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            obj, frozen, size = self._entries[key]
+
+        if frozen:
+            return True, obj
+        return True, copy.deepcopy(obj)
+
+    def peek(self, key):
+
+        """
+        Entry as stored, without counting an access
+        (to be given back to 'put' only)
+        :return: (object, size) or None
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[0], entry[2]
+
+    def put(self, key, obj, size):
+
+        """
+        :param obj: object, as returned by 'freeze' if possible
+        :param size: int, size of the object (in bytes)
+        :return: object that can be given to the caller
+        """
+
+        frozen = freeze(obj)
+        if frozen is not None or obj is None:
+            obj, is_frozen = frozen, True
+        else:
+            obj, is_frozen = copy.deepcopy(obj), False
+
+        if size <= self.max_bytes:
+            with self._lock:
+                if key in self._entries:
+                    self._n_bytes -= self._entries.pop(key)[2]
+                self._entries[key] = obj, is_frozen, size
+                self._n_bytes += size
+                while len(self._entries) > self.max_entries \
+                        or self._n_bytes > self.max_bytes:
+                    self._n_bytes -= self._entries.popitem(last=False)[1][2]
+
+        if is_frozen:
+            return obj
+        return copy.deepcopy(obj)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+
+MEMORY = MemoryCache()
+
+
+def set_memory_budget(max_entries=None, max_bytes=None):
+
+    """
+    Bound the in-process tier of the cache
+    :param max_entries: int or None (unchanged)
+    :param max_bytes: int or None (unchanged)
+    """
+
+    if max_entries is not None:
+        MEMORY.max_entries = max_entries
+    if max_bytes is not None:
+        MEMORY.max_bytes = max_bytes
@@ -0,0 +1,309 @@
+import os
+import pickle
+import struct
+
+from utils.cache.compression import CODECS, pack, unpack
+from utils.cache.files import atomic_write
+
+# Shard files group the entries of a function: records are appended
+# one after the other, each append ending with an index (position of
+# every record) and a footer that points to this index. The index is
+# either complete ('IDX0') or only the records of the append ('IDX1',
+# with the position of the previous index), so that an append doesn't
+# rewrite the index of the whole file
+SHARD_HEADER = struct.Struct('<4s20sBQQ')  # Tag, key, codec, size, raw size
+SHARD_FOOTER = struct.Struct('<Q4s')  # Position of the index, tag
+SHARD_CODECS = (None, ) + tuple(CODECS)
+
+# Records closer than this are read in a single operation
+SHARD_GAP = 64 * 1024
+
+# Bytes of old indexes (and duplicates) tolerated before rewriting a shard
+SHARD_SLACK = 1024 ** 2
+
+# Maximum number of partial indexes in a row (read one after the other)
+SHARD_CHAIN = 1024
+
+# Index of each shard file: {f_name: (inode, size, index, end, chain)}
+_shard_indexes = {}
+
+
+def shard_file(folder, key, n_shards):
+    return os.path.join(folder,
+                        f"shard-{int(key[:8], 16) % n_shards:03d}.bin")
+
+
+def read_at(f, offset, n):
+    f.seek(offset)
+    return f.read(n)
+
+
+def read_chain(f, position):
+
+    """
+    Read the indexes from the last one back to the last complete one
+    :param position: int, position of the last index
+    :return: (dict, index, tuple (position of the last index,
+    number of entries and number of partial indexes since the last
+    complete one)), or None if the indexes are not valid
+    """
+
+    deltas = []
+    last = position
+    while len(deltas) <= SHARD_CHAIN:
+        tag, _, _, n, _ = SHARD_HEADER.unpack(
+            read_at(f, position, SHARD_HEADER.size))
+        blob = read_at(f, position + SHARD_HEADER.size, n)
+        if len(blob) != n:
+            return None
+        if tag == b'IDX0':
+            index = pickle.loads(blob)
+            break
+        if tag != b'IDX1':
+            return None
+        position, delta = pickle.loads(blob)
+        deltas.append(delta)
+    else:
+        return None
+
+    for delta in reversed(deltas):
+        index.update(delta)
+    return index, (last, sum(len(d) for d in deltas), len(deltas))
+
+
+def read_index(f_name, f):
+
+    """
+    Index of an open shard file. If the last append was interrupted,
+    the index is rebuilt from the complete records
+    :return: (dict {key: (position, size, codec, raw size)},
+    int, end of the valid part of the file,
+    tuple or None, state of the chain of indexes (see 'read_chain'))
+    """
+
+    st = os.fstat(f.fileno())
+    cached = _shard_indexes.get(f_name)
+    if cached is not None and cached[:2] == (st.st_ino, st.st_size):
+        return cached[2:]
+
+    size = st.st_size
+    index, end, chain = None, 0, None
+
+    if size >= SHARD_HEADER.size + SHARD_FOOTER.size:
+        position, tag = SHARD_FOOTER.unpack(
+            read_at(f, size - SHARD_FOOTER.size, SHARD_FOOTER.size))
+        if tag == b'END0' and position + SHARD_HEADER.size <= size:
+            tag, _, _, n, _ = SHARD_HEADER.unpack(
+                read_at(f, position, SHARD_HEADER.size))
+            start = position + SHARD_HEADER.size
+            if tag in (b'IDX0', b'IDX1') \
+                    and start + n + SHARD_FOOTER.size == size:
+                found = read_chain(f, position)
+                if found is not None:
+                    (index, chain), end = found, size
+
+    if index is None:
+        index, position = {}, 0
+        while position + SHARD_HEADER.size <= size:
+            tag, key, codec, n, raw_n = SHARD_HEADER.unpack(
+                read_at(f, position, SHARD_HEADER.size))
+            start = position + SHARD_HEADER.size
+            is_index = tag in (b'IDX0', b'IDX1')
+            stop = start + n + (SHARD_FOOTER.size if is_index else 0)
+            if not (is_index or tag == b'REC0') or stop > size:
+                break
+            if tag == b'REC0':
+                index[key.hex()] = start, n, codec, raw_n
+            position = end = stop
+
+    _shard_indexes[f_name] = st.st_ino, st.st_size, index, end, chain
+    return index, end, chain
+
+
+def encode_record(key, data, info, codec=None):
+
+    """
+    :return: (bytes, record of a shard file, int, size of the data
+    (in bytes, before compression))
+    """
+
+    if codec is None:
+        raw = pickle.dumps((info, data), protocol=4)
+        blob = raw
+    else:
+        raw = pickle.dumps((info, pack(data)), protocol=4)
+        blob = CODECS[codec][0](raw)
+
+    header = SHARD_HEADER.pack(b'REC0', bytes.fromhex(key),
+                               SHARD_CODECS.index(codec),
+                               len(blob), len(raw))
+    return header + blob, len(raw)
+
+
+def decode_record(blob, codec):
+
+    codec = SHARD_CODECS[codec]
+    if codec is None:
+        return pickle.loads(blob)[1]
+    return unpack(pickle.loads(CODECS[codec][1](blob))[1])
+
+
+def read_shards(folder, keys, n_shards, stats=None):
+
+    """
+    Read entries from the shard files, with one read operation
+    for the records of the same shard that are close to each other
+    :param keys: iterable of keys
+    :param n_shards: int, number of shard files of the function
+    :param stats: CacheStats or None, counts the bytes read
+    :return: dict {key: (data, size (in bytes, before compression))}
+    of the keys that were found
+    """
+
+    by_shard = {}
+    for key in keys:
+        by_shard.setdefault(shard_file(folder, key, n_shards),
+                            []).append(key)
+
+    entries = {}
+
+    for f_name, shard_keys in by_shard.items():
+        try:
+            with open(f_name, 'rb') as f:
+                index, _, _ = read_index(f_name, f)
+                found = sorted((index[k] + (k, ) for k in set(shard_keys)
+                                if k in index))
+
+                n_bytes = 0
+                i = 0
+                while i < len(found):
+                    # Extend the read to the following records if close
+                    j = i + 1
+                    while j < len(found) and found[j][0] \
+                            <= found[j - 1][0] + found[j - 1][1] + SHARD_GAP:
+                        j += 1
+                    start = found[i][0]
+                    buffer = read_at(f, start,
+                                     found[j - 1][0] + found[j - 1][1] - start)
+                    n_bytes += len(buffer)
+                    for position, n, codec, raw_n, key in found[i:j]:
+                        blob = buffer[position - start:position - start + n]
+                        entries[key] = decode_record(blob, codec), raw_n
+                    i = j
+
+            if found:
+                # Register the access (for the eviction of old entries)
+                os.utime(f_name)
+                if stats is not None:
+                    stats.add(bytes_read=n_bytes)
+
+        except FileNotFoundError:  # No shard (or evicted meanwhile)
+            continue
+
+    return entries
+
+
+def append_records(f, index, end, records, chain=None):
+
+    """
+    Append records to a shard file, followed by an index and a footer.
+    The index only has the new records, unless the partial indexes
+    since the last complete one would have more entries than it
+    (so that the indexes written stay proportional to the records)
+    :param f: shard file, open in append mode
+    :param index: dict, current index of the file (see 'read_index')
+    :param end: int, end of the valid part of the file
+    :param records: dict {key: bytes}, as returned by 'encode_record'
+    :param chain: tuple or None, state of the chain of indexes
+    (see 'read_chain'), None to write a complete index
+    :return: (dict, new index, int, number of bytes written,
+    tuple, new state of the chain)
+    """
+
+    # Drop what an interrupted append left
+    f.truncate(end)
+
+    index = dict(index)
+    delta = {}
+    chunks = []
+    position = end
+    for key, record in records.items():
+        _, _, codec, n, raw_n = SHARD_HEADER.unpack_from(record)
+        delta[key] = position + SHARD_HEADER.size, n, codec, raw_n
+        chunks.append(record)
+        position += len(record)
+
+    if chain is not None and chain[1] + len(delta) <= len(index) \
+            and chain[2] < SHARD_CHAIN:
+        blob = pickle.dumps((chain[0], delta), protocol=4)
+        tag = b'IDX1'
+        chain = position, chain[1] + len(delta), chain[2] + 1
+    else:
+        tag = b'IDX0'
+        chain = position, 0, 0
+
+    index.update(delta)
+    if tag == b'IDX0':
+        blob = pickle.dumps(index, protocol=4)
+
+    chunks += [SHARD_HEADER.pack(tag, bytes(20), 0, len(blob), 0),
+               blob, SHARD_FOOTER.pack(position, b'END0')]
+    buffer = b''.join(chunks)
+
+    f.write(buffer)
+    f.flush()
+    os.fsync(f.fileno())
+
+    return index, len(buffer), chain
+
+
+def append_shards(folder, records, n_shards, stats=None):
+
+    """
+    Append records to the shard files, with one write operation per
+    shard (to be called under the lock of the folder)
+    :param records: dict {key: bytes}, as returned by 'encode_record'
+    :param n_shards: int, number of shard files of the function
+    :param stats: CacheStats or None, counts the bytes written
+    :return: list of string, shard files that were written
+    """
+
+    by_shard = {}
+    for key, record in records.items():
+        by_shard.setdefault(shard_file(folder, key, n_shards),
+                            {})[key] = record
+
+    for f_name, shard_records in by_shard.items():
+
+        with open(f_name, 'a+b') as f:
+            index, end, chain = read_index(f_name, f)
+            index, n_bytes, chain = append_records(f, index, end,
+                                                   shard_records, chain)
+            st = os.fstat(f.fileno())
+            _shard_indexes[f_name] = \
+                st.st_ino, st.st_size, index, st.st_size, chain
+
+        if stats is not None:
+            stats.add(bytes_written=n_bytes)
+
+        live = sum(SHARD_HEADER.size + n for _, n, _, _ in index.values())
+        if st.st_size - live > max(live, SHARD_SLACK):
+            compact_shard(f_name)
+
+    return list(by_shard)
+
+
+def compact_shard(f_name):
+
+    """
+    Rewrite a shard file without its old indexes and overwritten records
+    (to be called under the lock of the folder)
+    """
+
+    with open(f_name, 'rb') as f:
+        index, _, _ = read_index(f_name, f)
+        records = {key: read_at(f, position - SHARD_HEADER.size,
+                                SHARD_HEADER.size + n)
+                   for key, (position, n, _, _) in index.items()}
+
+    atomic_write(f_name, lambda f: append_records(f, {}, 0, records))
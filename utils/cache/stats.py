@@ -0,0 +1,123 @@
+import os
+import json
+import atexit
+import threading
+
+
+class CacheStats:
+
+    """
+    Counters of the cache of a decorated function:
+    * hits (from memory or from the files) and misses,
+    * time (in seconds) spent in the lookup (hash of the arguments and
+    probes, including those that fail), in the load of entries found on
+    disk, in the function itself, and in the writing of new entries,
+    * bytes read and written
+    """
+
+    FIELDS = ('memory_hits', 'disk_hits', 'misses',
+              'lookup_time', 'load_time', 'compute_time', 'write_time',
+              'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                self.counts[k] += v
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def as_dict(self):
+
+        with self._lock:
+            counts = dict(self.counts)
+
+        n_calls = counts['memory_hits'] + counts['disk_hits'] \
+            + counts['misses']
+        counts['calls'] = n_calls
+        counts['hit_rate'] = \
+            (n_calls - counts['misses']) / n_calls if n_calls else None
+        return counts
+
+
+# Counters of each decorated function (by name)
+STATS = {}
+
+
+def get_stats(name=None):
+
+    """
+    :param name: string (name of a decorated function) or None (all)
+    :return: dict of counters (see 'CacheStats')
+    """
+
+    if name is not None:
+        return STATS[name].as_dict()
+    return {k: s.as_dict() for k, s in STATS.items()}
+
+
+def stats_snapshot():
+
+    """
+    :return: dict {name of a decorated function: dict of counters}
+    """
+
+    return {k: s.snapshot() for k, s in STATS.items()}
+
+
+def stats_changes(snapshot):
+
+    """
+    Changes of the counters since 'snapshot' (e.g. in a worker
+    process, whose counters start from those of its parent)
+    :param snapshot: dict, as returned by 'stats_snapshot'
+    :return: dict {name of a decorated function: dict of counters}
+    """
+
+    changes = {}
+    for name, counts in stats_snapshot().items():
+        before = snapshot.get(name, {})
+        delta = {k: v - before.get(k, 0) for k, v in counts.items()}
+        if any(delta.values()):
+            changes[name] = delta
+    return changes
+
+
+def merge_stats(changes):
+
+    """
+    Add changes of the counters (e.g. sent back by a worker process)
+    to the counters of this process
+    :param changes: dict, as returned by 'stats_changes'
+    """
+
+    for name, counts in changes.items():
+        STATS.setdefault(name, CacheStats()).add(**counts)
+
+
+def dump_stats(f_name):
+
+    """
+    Write the counters of every decorated function in a JSON file
+    """
+
+    with open(f_name, 'w') as f:
+        json.dump(get_stats(), f, indent=2)
+
+
+def dump_stats_at_exit(f_name):
+    atexit.register(dump_stats, f_name)
+
+
+# e.g. BKP_STATS_FILE=cache_stats.json python draft.py
+if os.environ.get("BKP_STATS_FILE"):
+    dump_stats_at_exit(os.environ["BKP_STATS_FILE"])
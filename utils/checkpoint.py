@@ -0,0 +1,104 @@
+import os
+import copy
+import pickle
+import hashlib
+import contextlib
+
+from tqdm.autonotebook import tqdm
+
+from utils.cache.keys import fingerprint
+from utils.cache.files import atomic_dump
+
+CHECKPOINT_FOLDER = os.path.join("bkp", "checkpoint")
+
+# Default number of calls between two saves
+EVERY = 20
+
+
+class Checkpoint:
+
+    """
+    Results of the calls of a long loop, saved on disk as they come,
+    so that a new run of the same loop (e.g. after a crash) only does
+    the calls that are not done yet
+    """
+
+    def __init__(self, name):
+
+        """
+        :param name: string, identity of the loop
+        """
+
+        self.f_name = os.path.join(CHECKPOINT_FOLDER, f"{name}.p")
+
+        try:
+            with open(self.f_name, 'rb') as f:
+                self.results = pickle.load(f)
+        except FileNotFoundError:
+            self.results = {}
+
+    def update(self, results):
+
+        """
+        :param results: iterable of (index of the call, result)
+        """
+
+        self.results.update(results)
+
+        os.makedirs(CHECKPOINT_FOLDER, exist_ok=True)
+        atomic_dump(self.results, self.f_name)
+
+    def remove(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.f_name)
+
+
+def map_calls(executor, func, calls, every=None, desc=None):
+
+    """
+    Same as 'executor.map_calls', saving the results every 'every'
+    calls. The checkpoint is named after 'func' and 'calls', so that
+    a new run of the same calls resumes from it. It is removed
+    once all the calls are done
+    :param executor: Executor (see 'utils.executor')
+    :param func: function
+    :param calls: list of dicts (keyword arguments)
+    :param every: int or None (default: 'EVERY'), number of calls
+    between two saves (at least one per worker)
+    :param desc: string, label of the progress bar
+    :return: list of results, in the order of the calls
+    """
+
+    h = hashlib.sha1()
+    fingerprint(func, h)
+    fingerprint(calls, h)
+    checkpoint = Checkpoint(f"{func.__name__}_{h.hexdigest()}")
+
+    todo = [i for i in range(len(calls)) if i not in checkpoint.results]
+    every = max(every or EVERY, executor.n_workers)
+
+    # A single pool for all the calls, with chunks small enough
+    # for the workers to report several times between two saves
+    chunk_executor = copy.copy(executor)
+    if chunk_executor.chunk_size is None:
+        chunk_executor.chunk_size = max(1, every // executor.n_workers)
+
+    with tqdm(total=len(calls), initial=len(calls) - len(todo), desc=desc,
+              disable=not executor.progress) as pbar:
+        done = []
+        try:
+            for i, result in chunk_executor.iter_calls(
+                    func, [calls[i] for i in todo]):
+                done.append((todo[i], result))
+                pbar.update(1)
+                if len(done) >= every:
+                    checkpoint.update(done)
+                    done = []
+        finally:
+            # Also keep what was done before an error
+            if done:
+                checkpoint.update(done)
+
+    results = [checkpoint.results[i] for i in range(len(calls))]
+    checkpoint.remove()
+    return results
@@ -0,0 +1,323 @@
+import os
+import time
+import functools
+import threading
+import contextlib
+
+from utils.cache.keys import call_key
+from utils.cache.files import BKP_FOLDER, locked, touch, \
+    write_entry, read_entry
+from utils.cache.evict import PIN_FILE, scan, evict, enforce_disk_budget
+from utils.cache.compression import CODECS
+from utils.cache.shards import shard_file, encode_record, read_shards, \
+    append_shards
+from utils.cache.memory import MEMORY
+from utils.cache.stats import STATS, CacheStats
+
+
+def use_pickle(func=None, max_bytes=None, pin=False, compress=None,
+               shards=None, ignore=()):
+
+    """
+    Decorator that does the following:
+    * If a pickle file corresponding to the call exists,
+    it load the data from it instead of calling the function.
+    * If no such pickle file exists, it calls 'func',
+    creates the file and saves the output in it
+    Can be used as '@use_pickle' or '@use_pickle(max_bytes=..., pin=...)'.
+    The decorated function also has 'prefetch', 'lookup' and 'store'
+    methods, and 'stats' (see 'utils.cache.stats.CacheStats')
+    :param func: any function
+    :param max_bytes: int or None, quota of the function on disk
+    :param pin: bool, if True, the entries of the function are never
+    evicted to respect the global budget
+    :param compress: None, 'zlib', 'bz2' or 'lzma', codec of the entries
+    :param shards: int or None, number of shard files in which the
+    entries are grouped (None: one or a few files per entry)
+    :param ignore: names of the arguments left out of the key
+    :return: output of func(*args, **kwargs)
+    """
+
+    if func is None:
+        return functools.partial(use_pickle, max_bytes=max_bytes, pin=pin,
+                                 compress=compress, shards=shards,
+                                 ignore=ignore)
+
+    assert compress is None or compress in CODECS, \
+        f"'compress' should be None or one of {tuple(CODECS)}"
+
+    folder = os.path.join(BKP_FOLDER, f"{func.__name__}")
+    stats = STATS.setdefault(func.__name__, CacheStats())
+
+    # Records of a sharded function waiting for the end of a 'prefetch'
+    # block to be written: {key: (data, record, size)}
+    # (only in the process that opened the block: forked workers
+    # write their entries right away)
+    pending = {}
+    n_blocks = 0
+    block_pid = None
+    pending_lock = threading.Lock()
+
+    # Entries loaded by the open 'prefetch' blocks, kept until they exit
+    # (whatever the bounds of 'MEMORY'): {key: (data, size)}
+    prefetched = {}
+
+    def as_call(call):
+        if isinstance(call, dict):
+            return (), call
+        return tuple(call), {}
+
+    def entry_file(key):
+
+        # File whose last access is that of the entry
+        # (see 'utils.cache.evict.scan')
+        if shards is not None:
+            return shard_file(folder, key, shards)
+        return os.path.join(folder, f"{key}_info.p")
+
+    def from_memory(key):
+
+        hit, data = MEMORY.get((func.__name__, key))
+        if not hit:
+            with pending_lock:
+                entry = pending.get(key)
+                if entry is not None:  # Not written yet
+                    entry = entry[0], entry[2]
+                else:
+                    entry = prefetched.get(key)
+            if entry is not None:  # Dropped from memory meanwhile
+                hit = True
+                data = MEMORY.put((func.__name__, key), entry[0],
+                                  size=entry[1])
+        if hit:
+            # Register the access on disk too, so that the entries
+            # used from memory are not the first to be evicted
+            touch(entry_file(key))
+        return hit, data
+
+    def load(keys):
+
+        if shards is not None:
+            return read_shards(folder, keys, shards, stats=stats)
+
+        entries = {}
+        for key in keys:
+            hit, data, size = read_entry(folder, key, stats=stats)
+            if hit:
+                entries[key] = data, size
+        return entries
+
+    def write(records):
+
+        """
+        :param records: dict {key: (data, info)}, or {key: bytes} (as
+        returned by 'encode_record') for a sharded function
+        :return: dict {key: size (in bytes, before compression)}
+        for a function that is not sharded
+        """
+
+        os.makedirs(folder, exist_ok=True)
+        if pin:
+            open(os.path.join(folder, PIN_FILE), 'a').close()
+
+        sizes = {}
+
+        with locked(folder):
+            if shards is not None:
+                keep = [os.path.basename(f_name) for f_name in
+                        append_shards(folder, records, shards, stats=stats)]
+            else:
+                for key, (data, info) in records.items():
+                    sizes[key] = write_entry(folder, key, data, info,
+                                             codec=compress, stats=stats)
+                keep = list(records)
+
+            if max_bytes is not None:
+                evict(scan(folder), max_bytes=max_bytes, keep=keep)
+
+        enforce_disk_budget(keep=[(func.__name__, k) for k in keep])
+        return sizes
+
+    @functools.wraps(func)
+    def call_func(*args, **kwargs):
+
+        t0 = time.perf_counter()
+
+        key = call_key(func, args, kwargs, ignore)
+
+        hit, data = from_memory(key)
+        if hit:
+            stats.add(memory_hits=1, lookup_time=time.perf_counter() - t0)
+            return data
+
+        t1 = time.perf_counter()
+
+        entries = load([key])
+        if key in entries:
+            data, size = entries[key]
+            data = MEMORY.put((func.__name__, key), data, size=size)
+            stats.add(disk_hits=1, lookup_time=t1 - t0,
+                      load_time=time.perf_counter() - t1)
+            return data
+
+        t2 = time.perf_counter()
+
+        data = func(*args, **kwargs)
+
+        t3 = time.perf_counter()
+
+        # Keep the arguments next to the data (for inspection only)
+        info = {'args': args, 'kwargs': kwargs}
+
+        if shards is None:
+            size = write({key: (data, info)})[key]
+            data = MEMORY.put((func.__name__, key), data, size=size)
+
+        else:
+            record, size = encode_record(key, data, info, codec=compress)
+            data = MEMORY.put((func.__name__, key), data, size=size)
+            with pending_lock:
+                deferred = n_blocks > 0 and os.getpid() == block_pid
+                if deferred:
+                    pending[key] = data, record, size
+            if not deferred:
+                write({key: record})
+
+        stats.add(misses=1, lookup_time=t2 - t0, compute_time=t3 - t2,
+                  write_time=time.perf_counter() - t3)
+
+        return data
+
+    def lookup(calls):
+
+        """
+        Outputs of the calls that are in the cache, without calling
+        'func' for the others (see 'store')
+        :param calls: list of dicts (keyword arguments)
+        or tuples (positional arguments)
+        :return: dict {index of the call in 'calls': output}
+        """
+
+        t0 = time.perf_counter()
+
+        keys = [call_key(func, *as_call(c), ignore) for c in calls]
+
+        found = {}
+        for i, key in enumerate(keys):
+            hit, data = from_memory(key)
+            if hit:
+                found[i] = data
+        n_memory = len(found)
+
+        t1 = time.perf_counter()
+
+        entries = load(dict.fromkeys(k for i, k in enumerate(keys)
+                                     if i not in found))
+        for i, key in enumerate(keys):
+            if i not in found and key in entries:
+                data, size = entries[key]
+                found[i] = MEMORY.put((func.__name__, key), data, size=size)
+
+        stats.add(memory_hits=n_memory, disk_hits=len(found) - n_memory,
+                  lookup_time=t1 - t0, load_time=time.perf_counter() - t1)
+
+        return found
+
+    def store(calls, outputs):
+
+        """
+        Put in the cache outputs of 'func' computed by other means
+        (e.g. for a whole batch of calls at once), with one write
+        per shard for a sharded function
+        :param calls: list of dicts (keyword arguments)
+        or tuples (positional arguments)
+        :param outputs: list, output of 'func' for each call
+        :return: list, outputs as returned by the calls
+        """
+
+        t0 = time.perf_counter()
+
+        keys = []
+        records = {}
+        sizes = {}
+        for call, data in zip(calls, outputs):
+            args, kwargs = as_call(call)
+            key = call_key(func, args, kwargs, ignore)
+            info = {'args': args, 'kwargs': kwargs}
+            if shards is None:
+                records[key] = data, info
+            else:
+                records[key], sizes[key] = \
+                    encode_record(key, data, info, codec=compress)
+            keys.append(key)
+
+        if records:
+            sizes.update(write(records))
+
+        outputs = [MEMORY.put((func.__name__, key), data, size=sizes[key])
+                   for key, data in zip(keys, outputs)]
+
+        stats.add(misses=len(keys), write_time=time.perf_counter() - t0)
+
+        return outputs
+
+    @contextlib.contextmanager
+    def prefetch(calls=()):
+
+        """
+        Load the entries of 'calls' in memory before a loop (with one
+        read per shard for a sharded function), and, for a sharded
+        function, write the entries computed in the block only
+        when leaving it (with one write per shard)
+        :param calls: iterable of dicts (keyword arguments)
+        or tuples (positional arguments)
+        """
+
+        nonlocal n_blocks, block_pid
+
+        t0 = time.perf_counter()
+
+        keys = [call_key(func, *as_call(c), ignore) for c in calls]
+
+        # Keep the entries for the whole block (the loop may use
+        # more entries than 'MEMORY' holds)
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):
+            entry = MEMORY.peek((func.__name__, key))
+            if entry is not None:
+                found[key] = entry
+            else:
+                missing.append(key)
+        for key, (data, size) in load(missing).items():
+            MEMORY.put((func.__name__, key), data, size=size)
+            found[key] = MEMORY.peek((func.__name__, key)) or (data, size)
+
+        stats.add(load_time=time.perf_counter() - t0)
+
+        with pending_lock:
+            if n_blocks == 0:
+                block_pid = os.getpid()
+            n_blocks += 1
+            prefetched.update(found)
+        try:
+            yield
+        finally:
+            with pending_lock:
+                n_blocks -= 1
+                records = {}
+                if n_blocks == 0:
+                    records = {k: r for k, (_, r, _) in pending.items()}
+                    prefetched.clear()
+            if records:
+                t0 = time.perf_counter()
+                write(records)
+                with pending_lock:
+                    for key in records:
+                        pending.pop(key, None)
+                stats.add(write_time=time.perf_counter() - t0)
+
+    call_func.stats = stats
+    call_func.lookup = lookup
+    call_func.store = store
+    call_func.prefetch = prefetch
+    return call_func
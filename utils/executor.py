@@ -0,0 +1,260 @@
+import os
+import functools
+import contextlib
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+    as_completed
+
+from tqdm.autonotebook import tqdm
+
+import utils.shared as shared
+import utils.cache.stats as cache_stats
+
+BACKENDS = "serial", "thread", "process"
+
+# Default number of chunks given to each worker
+CHUNKS_PER_WORKER = 4
+
+
+def apply_each(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def call_each(func, chunk):
+    return [func(**kwargs) for kwargs in chunk]
+
+
+def with_stats(func, chunk):
+
+    """
+    Apply 'func' to a chunk in a worker process, and send back the
+    changes of the counters of the cache (see 'utils.cache.stats.STATS')
+    with the results, as the worker's own counters stay in it
+    :return: (list of results, dict of changes of the counters)
+    """
+
+    snapshot = cache_stats.stats_snapshot()
+    results = func(chunk)
+    return results, cache_stats.stats_changes(snapshot)
+
+
+class Executor:
+
+    """
+    Map of a function over the items of a loop, serially, with a pool
+    of threads or with a pool of processes. Results are always returned
+    in the order of the items, so that (with the seeds of the items
+    drawn beforehand) they don't depend on the backend.
+    With processes, the function and the items have to be picklable
+    (functions defined at the top level of a module, possibly
+    wrapped by 'functools.partial'), and the workers are forked
+    when possible (so that they share the state of the parent)
+    """
+
+    def __init__(self, backend="serial", n_workers=None, chunk_size=None,
+                 progress=True):
+
+        """
+        :param backend: 'serial', 'thread' or 'process'
+        :param n_workers: int or None (number of CPUs)
+        :param chunk_size: int or None, number of items per task
+        (None: a few chunks per worker, to balance the load)
+        :param progress: bool, show a progress bar
+        """
+
+        assert backend in BACKENDS, f"backend should be one of {BACKENDS}"
+
+        self.backend = backend
+        self.n_workers = 1 if backend == "serial" \
+            else n_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+        # Pool kept for several maps (see 'kept_open')
+        self._pool = None
+
+    def __getstate__(self):
+        # A pool can't be sent to another process
+        return dict(self.__dict__, _pool=None)
+
+    def chunks(self, items):
+
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            n_chunks = 1 if self.backend == "serial" \
+                else CHUNKS_PER_WORKER * self.n_workers
+            chunk_size = max(1, -(-len(items) // n_chunks))
+
+        return [items[i:i + chunk_size]
+                for i in range(0, len(items), chunk_size)]
+
+    def pool(self):
+
+        if self.backend == "thread":
+            return ThreadPoolExecutor(max_workers=self.n_workers)
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = None
+        return ProcessPoolExecutor(max_workers=self.n_workers,
+                                   mp_context=context)
+
+    @contextlib.contextmanager
+    def kept_open(self):
+
+        """
+        Use a single pool for all the maps of the block
+        (otherwise, each map has its own), to be used as
+        'with executor.kept_open(): ...'
+        """
+
+        if self.backend == "serial" or self._pool is not None:
+            yield self
+            return
+
+        with self.pool() as pool:
+            self._pool = pool
+            try:
+                yield self
+            finally:
+                self._pool = None
+
+    def shared(self, *arrays):
+
+        """
+        Arrays that the workers read or write without copy: in shared
+        memory for the process backend (see 'utils.shared.share'),
+        as they are otherwise. To be used as
+        'with executor.shared(a, b) as (a_, b_): ...', and to be
+        given to the workers as 'a_', used by them as 'a_.array'
+        """
+
+        return shared.share(*arrays, local=self.backend != "process")
+
+    def iter_batches(self, func, items):
+
+        """
+        Apply a function to chunks of items (for functions that are
+        vectorized over the items), with a single pool for all the chunks
+        :param func: function taking a list of items and returning
+        a list of results (one per item)
+        :param items: sequence
+        :return: generator of (index of the item, result),
+        as the chunks are done (with processes, the counters of the
+        cache of the workers are added to those of this process)
+        """
+
+        items = list(items)
+        chunks = self.chunks(items)
+        starts = itertools.accumulate([0] + [len(c) for c in chunks[:-1]])
+
+        if self.backend == "serial" \
+                or (len(chunks) <= 1 and self._pool is None):
+            for start, chunk in zip(starts, chunks):
+                yield from enumerate(func(chunk), start)
+            return
+
+        in_processes = self.backend == "process"
+        if in_processes:
+            func = functools.partial(with_stats, func)
+
+        with contextlib.ExitStack() as stack:
+            pool = self._pool or stack.enter_context(self.pool())
+            futures = {pool.submit(func, chunk): start
+                       for start, chunk in zip(starts, chunks)}
+            for future in as_completed(futures):
+                results = future.result()
+                if in_processes:
+                    results, changes = results
+                    cache_stats.merge_stats(changes)
+                yield from enumerate(results, futures[future])
+
+    def map_batches(self, func, items, desc=None):
+
+        """
+        Same as 'iter_batches', waiting for all the results
+        :param desc: string, label of the progress bar
+        :return: list of results, in the order of the items
+        """
+
+        items = list(items)
+        results = [None] * len(items)
+
+        with tqdm(total=len(items), desc=desc,
+                  disable=not self.progress) as pbar:
+            for i, result in self.iter_batches(func, items):
+                results[i] = result
+                pbar.update(1)
+
+        return results
+
+    def map(self, func, items, desc=None):
+
+        """
+        Apply a function to each item
+        :param func: function taking an item
+        :param items: sequence
+        :param desc: string, label of the progress bar
+        :return: list of results, in the order of the items
+        """
+
+        return self.map_batches(functools.partial(apply_each, func),
+                                items, desc=desc)
+
+    def iter_calls(self, func, calls):
+
+        """
+        Call a function for each set of arguments
+        :param func: function
+        :param calls: sequence of dicts (keyword arguments)
+        :return: generator of (index of the call, result),
+        as the calls are done
+        """
+
+        return self.iter_batches(functools.partial(call_each, func), calls)
+
+    def map_calls(self, func, calls, desc=None):
+
+        """
+        Call a function for each set of arguments
+        :param func: function
+        :param calls: sequence of dicts (keyword arguments)
+        :param desc: string, label of the progress bar
+        :return: list of results, in the order of the calls
+        """
+
+        return self.map_batches(functools.partial(call_each, func),
+                                calls, desc=desc)
+
+
+# Executor of the stages that are not given one
+_default = Executor()
+
+
+def set_default(backend="serial", n_workers=None, chunk_size=None,
+                progress=True):
+
+    """
+    Set the executor used by the stages that are not given one
+    (see 'Executor' for the parameters)
+    """
+
+    global _default
+    _default = Executor(backend=backend, n_workers=n_workers,
+                        chunk_size=chunk_size, progress=progress)
+
+
+def get(executor=None):
+
+    """
+    :param executor: Executor, name of a backend, or None (default)
+    :return: Executor
+    """
+
+    if executor is None:
+        return _default
+    if isinstance(executor, str):
+        return Executor(backend=executor)
+    return executor
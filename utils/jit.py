@@ -0,0 +1,82 @@
+import types
+import functools
+
+try:
+    import numba
+except ImportError:  # Numba is optional
+    numba = None
+
+BACKENDS = "numpy", "numba"
+
+_backend = "numba" if numba is not None else "numpy"
+
+
+def jit(func):
+
+    """
+    Compile 'func' with Numba (lazily, at the first call, or loaded from
+    the cache of a previous run), releasing the GIL so that it can run
+    in several threads at once.
+    Without Numba, 'func' is returned unchanged
+    :param func: function written in the subset of Python/NumPy
+    supported by Numba
+    :return: function
+    """
+
+    if numba is None:
+        return func
+    return numba.njit(nogil=True, cache=True)(func)
+
+
+def python(func):
+
+    """
+    Get the pure Python version of a function decorated with 'jit',
+    whose calls to other such functions are pure Python too
+    """
+
+    func = getattr(func, 'py_func', func)
+    if numba is None:
+        return func
+    return _python(func)
+
+
+@functools.lru_cache(maxsize=None)
+def _python(func):
+
+    # Globals of 'func' in which the compiled functions are replaced
+    # by their Python versions (using the same globals)
+    namespace = dict(func.__globals__)
+    for name, obj in func.__globals__.items():
+        if isinstance(obj, numba.core.dispatcher.Dispatcher):
+            namespace[name] = rebind(obj.py_func, namespace)
+    return rebind(func, namespace)
+
+
+def rebind(func, namespace):
+    return types.FunctionType(func.__code__, namespace, func.__name__,
+                              func.__defaults__, func.__closure__)
+
+
+def set_backend(name):
+
+    """
+    Select the backend used for the trial loops
+    :param name: 'numpy' or 'numba'
+    """
+
+    global _backend
+
+    assert name in BACKENDS, f"backend should be one of {BACKENDS}"
+    if name == "numba" and numba is None:
+        raise ImportError("Numba is required for the 'numba' backend")
+
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+def enabled():
+    return _backend == "numba"
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def generator(seed):
+
+    """
+    Create an independent random number generator
+    :param seed: int or np.random.SeedSequence
+    :return: np.random.Generator
+    """
+
+    return np.random.Generator(np.random.PCG64(seed))
+
+
+def spawn_seeds(seed, *shape):
+
+    """
+    Derive independent seeds from a parent seed (using
+    'SeedSequence.spawn'), one for each subject, parameter set or fit.
+    The seeds are plain integers so that they can be used as arguments
+    of cached functions
+    :param seed: int
+    :param shape: ints, shape of the array of seeds
+    :return: array of int
+    """
+
+    n = int(np.prod(shape))
+    children = np.random.SeedSequence(seed).spawn(n)
+    seeds = [int(c.generate_state(1, dtype=np.uint64)[0]) for c in children]
+    return np.array(seeds, dtype=object).reshape(shape)
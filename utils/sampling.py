@@ -0,0 +1,87 @@
+import numpy as np
+
+
+def categorical(p, u):
+
+    """
+    Select an option by inverting the cumulative distribution,
+    as 'np.random.choice' does, but without its per-call validation
+    :param p: array-like of shape (..., n_option), probabilities of choice
+    :param u: float or array-like of shape (...), uniform numbers in [0, 1)
+    :return: int or array of int, index of the selected option(s)
+    """
+
+    if np.ndim(p) == 1:
+        # For a single draw over a few options,
+        # plain Python is faster than NumPy
+        p = p.tolist() if isinstance(p, np.ndarray) else list(p)
+        total = sum(p)
+        cumulative = 0
+        for i, p_i in enumerate(p):
+            cumulative += p_i
+            if cumulative / total > u:
+                return i
+        return len(p) - 1
+
+    cdf = np.cumsum(p, axis=-1)
+    cdf /= cdf[..., -1:]
+    return np.sum(cdf <= np.expand_dims(u, -1), axis=-1)
+
+
+def bernoulli(p, u):
+
+    """
+    Draw successes with probability 'p', using the same convention
+    as 'np.random.choice([0, 1], p=[1-p, p])'
+    :param p: float or array-like, probability of success
+    :param u: float or array-like, uniform numbers in [0, 1)
+    :return: bool or array of bool
+    """
+
+    return u >= 1 - p
+
+
+class Sampler:
+
+    """
+    Source of uniform numbers pre-drawn by blocks, so that drawing
+    a choice or a success does not cost a call to the generator
+    """
+
+    def __init__(self, generator, block_size=1024):
+
+        """
+        :param generator: np.random.Generator (see 'utils.rng.generator')
+        :param block_size: int, number of uniform numbers drawn at once
+        """
+
+        self.generator = generator
+        self.block_size = block_size
+
+        self._block = np.zeros(0)
+        self._i = 0
+
+    def uniform(self, size=None):
+
+        n = 1 if size is None else int(np.prod(size))
+
+        if self._i + n > len(self._block):
+            rest = self._block[self._i:]
+            self._block = np.concatenate(
+                (rest, self.generator.random(
+                    max(self.block_size, n - len(rest)))))
+            self._i = 0
+
+        u = self._block[self._i:self._i + n]
+        self._i += n
+
+        if size is None:
+            return u[0]
+        return u.reshape(size)
+
+    def categorical(self, p):
+        shape = np.shape(p)[:-1]
+        return categorical(p, self.uniform(shape or None))
+
+    def bernoulli(self, p):
+        return bernoulli(p, self.uniform(np.shape(p) or None))
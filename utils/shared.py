@@ -0,0 +1,101 @@
+import contextlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Blocks of shared memory mapped by this process: {name: SharedMemory}
+_blocks = {}
+
+
+class SharedArray:
+
+    """
+    Array in shared memory. Only its name, shape and type are pickled,
+    so that it is sent to worker processes for free, and they attach
+    it without copying it (and can write their results in it)
+    """
+
+    def __init__(self, shape, dtype=float):
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+
+        n_bytes = int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        block = shared_memory.SharedMemory(create=True, size=max(1, n_bytes))
+        self.name = block.name
+        _blocks[self.name] = block
+
+    @classmethod
+    def from_array(cls, a):
+        a = np.asarray(a)
+        shared = cls(a.shape, a.dtype)
+        shared.array[...] = a
+        return shared
+
+    @property
+    def array(self):
+
+        block = _blocks.get(self.name)
+        if block is None:  # First use in this process
+            block = _blocks[self.name] = \
+                shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+
+    def release(self):
+
+        """
+        Free the memory (to be called by the process that created it)
+        """
+
+        block = _blocks.pop(self.name, None)
+        if block is not None:
+            block.unlink()
+            # Arrays that still use the block keep it mapped
+            with contextlib.suppress(BufferError):
+                block.close()
+
+
+class LocalArray:
+
+    """
+    Same interface as 'SharedArray', for workers of the same process
+    """
+
+    def __init__(self, a):
+        self.array = a
+
+    def release(self):
+        pass
+
+
+@contextlib.contextmanager
+def share(*arrays, local=False):
+
+    """
+    Place arrays where workers can read and write them without copy.
+    When leaving the block, what the workers wrote is copied back to
+    the arrays (unless they are read-only), and the memory is freed
+    :param arrays: arrays, inputs or buffers for the results
+    :param local: bool, if True, the workers are threads of this process,
+    and the arrays are simply wrapped
+    :return: list of handles (see 'SharedArray'), whose attribute 'array'
+    gives the array in any worker
+    """
+
+    if local:
+        yield [LocalArray(a) for a in arrays]
+        return
+
+    handles = []
+    try:
+        for a in arrays:
+            handles.append(SharedArray.from_array(a))
+        yield handles
+
+        for a, handle in zip(arrays, handles):
+            if isinstance(a, np.ndarray) and a.flags.writeable:
+                np.copyto(a, handle.array)
+
+    finally:
+        for handle in handles:
+            handle.release()